@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+
+# Content-addressed store of rendered outputs, shared between runs (and branches). Keys are hex
+# digests, values are strings; a missing entry is None.
+class DirectoryCache:
+    def __init__(self, directory, fs):
+        self.directory = directory
+        self.fs = fs
+
+    def get(self, key):
+        try:
+            return self.fs.read_string(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, content):
+        self.fs.write_string(self._path(key), content)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+
+# Same as DirectoryCache, but stored in S3 using the aws CLI
+class S3Cache:
+    def __init__(self, url, runner=subprocess.run):
+        self.url = url.rstrip("/")
+        self.runner = runner
+
+    def get(self, key):
+        output = self.runner(["aws", "s3", "cp", self._url(key), "-"], capture_output=True)
+        if output.returncode != 0:
+            return None
+        return output.stdout.decode()
+
+    def put(self, key, content):
+        output = self.runner(
+            ["aws", "s3", "cp", "-", self._url(key)], input=content.encode(), capture_output=True
+        )
+        # A failed upload only means the output will be rendered again next time
+        if output.returncode != 0:
+            print(f"Could not store {self._url(key)} in the cache", file=sys.stderr)
+
+    def _url(self, key):
+        return f"{self.url}/{key[:2]}/{key}"
+
+
+def cache_from(location, fs):
+    if location.startswith("s3://"):
+        return S3Cache(location)
+    return DirectoryCache(location, fs)
@@ -2,8 +2,18 @@ import argparse
 import os
 import sys
 
-from config import ConfigError, ConfigLoader
-from copier import Copier, Executor, PrintingExecutor, RelativeFormatter
+from cache import cache_from
+from comparison import TieredComparator
+from config import ConfigError, ConfigLoader, ProjectDetailsReader
+from copier import (
+    Copier,
+    Executor,
+    ParallelExecutor,
+    PrintingExecutor,
+    RelativeFormatter,
+    RenderError,
+)
+from dependencies import DependencyGraph, DependencyGraphLoader
 from detectors import (
     CopyDetector,
     DeleteDetector,
@@ -13,20 +23,243 @@ from detectors import (
     UnnecessaryOperationsFilteringDetector,
 )
 from filesystem import Filesystem
-from index import FileIndexLoader
+from hash import HashCacheLoader
+from incremental import Git, SyncState, SyncStateLoader, fingerprint, incremental_changes
+from index import FileIndexItem, FileIndexLoader
+from operations import (
+    CachingOpenAPIBundler,
+    CachingOpenAPIValidator,
+    CachingPlantUMLGenerator,
+    DockerPlantUMLGenerator,
+    OpenAPIBundler,
+    OpenAPIValidator,
+    PlantUMLIncludeResolver,
+)
+from plan import Plan, PlanError, PlanLoader
 
 INDEX_DIRECTORY = ".index"
 
+
+# Runs the detectors, returns the operations, and the sync state and dependency graph to record
+# once they are executed
+def detect(args, fs, index):
+    projects = ProjectDetailsReader(args.to_path, fs)
+    comparator = TieredComparator(args.trust_mtime, args.partial_hash)
+    config = ConfigLoader.default(args.from_path, args.to_path, fs, projects).load(
+        args.config_path, args.skip_invalid_documents
+    )
+    git = Git()
+    incremental = args.incremental or args.since is not None
+    current_fingerprint = fingerprint(
+        fs, args.config_path, os.path.join(args.to_path, "projects.json")
+    )
+    index_path = os.path.join(args.to_path, INDEX_DIRECTORY)
+    previous_dependencies = (
+        DependencyGraphLoader.load(index_path, args.index, fs, args.from_path)
+        if incremental
+        else None
+    )
+    changes = (
+        incremental_changes(
+            git,
+            args.from_path,
+            SyncStateLoader.load(index_path, args.index, fs),
+            current_fingerprint,
+            args.since,
+            previous_dependencies,
+        )
+        if incremental
+        else None
+    )
+    # A complete graph is known after scanning all files, or when the previous one is updated
+    if changes is None:
+        dependencies = DependencyGraph(args.from_path)
+    elif previous_dependencies is not None:
+        dependencies = previous_dependencies
+        dependencies.forget(changes.deleted)
+    else:
+        dependencies = None
+    resolver = PlantUMLIncludeResolver()
+    copy_detector = CopyDetector(
+        args.from_path,
+        args.to_path,
+        args.author,
+        args.branch,
+        config,
+        projects,
+        comparator,
+        paths=None if changes is None else changes.changed,
+    )
+    operations = OperationDetectorChain(
+        copy_detector,
+        PlantUMLDiagramsDetector(plantuml_generator(args, fs, resolver), resolver, dependencies),
+        OpenAPIDetector(*openapi_tools(args, fs), dependencies),
+        DeleteDetector(
+            args.index,
+            index,
+            args.from_path,
+            args.to_path,
+            scope=None if changes is None else copy_detector.destinations(fs, changes.deleted),
+        ),
+        UnnecessaryOperationsFilteringDetector(args.jobs),
+    ).operations(fs)
+    comparator.report()
+    if not incremental:
+        return operations, None, None
+    revision = git.head(args.from_path)
+    if revision is None:
+        return operations, None, None
+    return operations, SyncState(revision, current_fingerprint), dependencies
+
+
+def plantuml_generator(args, fs, resolver):
+    if args.render_cache is None:
+        return DockerPlantUMLGenerator()
+    return CachingPlantUMLGenerator(
+        DockerPlantUMLGenerator(), cache_from(args.render_cache, fs), resolver
+    )
+
+
+# Returns the OpenAPI bundler and validator
+def openapi_tools(args, fs):
+    if args.render_cache is None:
+        return OpenAPIBundler(), OpenAPIValidator()
+    cache = cache_from(args.render_cache, fs)
+    return (
+        CachingOpenAPIBundler(OpenAPIBundler(), cache),
+        CachingOpenAPIValidator(OpenAPIValidator(), cache),
+    )
+
+
+def executor_for(args, fs, formatter):
+    if args.jobs > 1:
+        return ParallelExecutor(fs, args.jobs, formatter, args.render_jobs)
+    return Executor(fs, formatter, args.render_jobs)
+
+
+def copy(args, fs):
+    index_path = os.path.join(args.to_path, INDEX_DIRECTORY)
+    save = not args.dry_run
+    with FileIndexLoader.loaded(index_path, fs, save) as index, HashCacheLoader.loaded(
+        args.hash_cache, fs, save
+    ) as hash_cache:
+        fs.hash_cache = hash_cache
+        operations, sync_state, dependencies = detect(args, fs, index)
+        formatter = RelativeFormatter(args.to_path, args.from_path)
+        Copier(
+            operations,
+            fs,
+            PrintingExecutor(formatter=formatter)
+            if args.dry_run
+            else executor_for(args, fs, formatter),
+        ).execute()
+        if save and sync_state is not None:
+            SyncStateLoader.save(sync_state, index_path, args.index, fs)
+        if save and dependencies is not None:
+            DependencyGraphLoader.save(dependencies, index_path, args.index, fs)
+
+
+# Same as a dry run of copy, but the operations are also stored in a plan file, see apply
+def plan(args, fs):
+    index_path = os.path.join(args.to_path, INDEX_DIRECTORY)
+    # The hash cache is saved, so that apply doesn't have to hash the planned files again
+    with FileIndexLoader.loaded(index_path, fs, False) as index, HashCacheLoader.loaded(
+        args.hash_cache, fs
+    ) as hash_cache:
+        fs.hash_cache = hash_cache
+        operations, sync_state, dependencies = detect(args, fs, index)
+        formatter = RelativeFormatter(args.to_path, args.from_path)
+        Copier(operations, fs, PrintingExecutor(formatter=formatter)).execute()
+        PlanLoader.save(
+            [
+                Plan(
+                    args.index,
+                    args.from_path,
+                    args.to_path,
+                    operations,
+                    [item.file for item in index.added],
+                    [item.file for item in index.removed],
+                    sync_state,
+                    dependencies,
+                )
+            ],
+            args.plan_path,
+            fs,
+        )
+
+
+# Executes the operations stored by plan (or merge), without detecting them again
+def apply(args, fs):
+    resolver = PlantUMLIncludeResolver()
+    generator = plantuml_generator(args, fs, resolver)
+    bundler, validator = openapi_tools(args, fs)
+    for stored in PlanLoader.load(args.plan_path, fs, generator, bundler, validator, resolver):
+        index_path = os.path.join(stored.to_path, INDEX_DIRECTORY)
+        with FileIndexLoader.loaded(index_path, fs) as index, HashCacheLoader.loaded(
+            args.hash_cache, fs
+        ) as hash_cache:
+            fs.hash_cache = hash_cache
+            stale = stored.stale_files(fs)
+            if stale:
+                raise PlanError(
+                    f"{len(stale)} source files of `{stored.repo}` changed since the plan was "
+                    f"made, e.g. `{stale[0]}`"
+                )
+            for file in stored.index_removed:
+                index.remove(FileIndexItem(file, stored.repo))
+            for file in stored.index_added:
+                index.add(FileIndexItem(file, stored.repo))
+            formatter = RelativeFormatter(stored.to_path, stored.from_path)
+            Copier(stored.operations, fs, executor_for(args, fs, formatter)).execute()
+            if stored.sync_state is not None:
+                SyncStateLoader.save(stored.sync_state, index_path, stored.repo, fs)
+            if stored.dependencies is not None:
+                DependencyGraphLoader.save(stored.dependencies, index_path, stored.repo, fs)
+
+
+def merge(args, fs):
+    PlanLoader.merge(args.inputs, args.plan_path, fs)
+
+
+# Prints the changes stored in a plan file as plan listed them, or their number with --count
+def show(args, fs):
+    plans = PlanLoader.load(args.plan_path, fs)
+    if args.count:
+        print(sum(stored.count for stored in plans))
+        return
+    for stored in plans:
+        for line in stored.listing:
+            print(line)
+
+
 if __name__ == "__main__":
     fs = Filesystem()
     parser = argparse.ArgumentParser(
         epilog="""A program, that synchronizes files between two directories, using a configuration file."""
     )
-    parser.add_argument("command", choices=["copy"])
-    parser.add_argument("--index", dest="index", required=True)
-    parser.add_argument("--from", dest="from_path", required=True)
-    parser.add_argument("--to", dest="to_path", required=True)
-    parser.add_argument("--config", dest="config_path", required=True)
+    parser.add_argument(
+        "command",
+        choices=["copy", "plan", "apply", "merge", "show"],
+        help="copy: detect and execute the changes, plan: detect the changes and store them in "
+        "a plan file, apply: execute the changes stored in a plan file, merge: combine the plan "
+        "files given as arguments into one, show: list the changes stored in a plan file",
+    )
+    parser.add_argument("inputs", nargs="*", help="Plan files combined by merge")
+    parser.add_argument("--index", dest="index")
+    parser.add_argument("--from", dest="from_path")
+    parser.add_argument("--to", dest="to_path")
+    parser.add_argument("--config", dest="config_path")
+    parser.add_argument(
+        "--plan",
+        dest="plan_path",
+        help="Plan file written by plan and merge, read by apply and show",
+    )
+    parser.add_argument(
+        "--count",
+        dest="count",
+        action=argparse.BooleanOptionalAction,
+        help="Make show print the number of changes instead of listing them",
+    )
     parser.add_argument("--branch", dest="branch", default="master")
     parser.add_argument("--author", dest="author", default="unknown author")
     parser.add_argument("--dry-run", dest="dry_run", action=argparse.BooleanOptionalAction)
@@ -35,35 +268,88 @@ if __name__ == "__main__":
         dest="skip_invalid_documents",
         action=argparse.BooleanOptionalAction,
     )
+    parser.add_argument(
+        "--trust-mtime",
+        dest="trust_mtime",
+        action=argparse.BooleanOptionalAction,
+        help="Treat copied files with the same size and mtime as their source as unchanged",
+    )
+    parser.add_argument(
+        "--partial-hash",
+        dest="partial_hash",
+        action=argparse.BooleanOptionalAction,
+        help="Compare the beginnings of large files before hashing them in full",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        dest="hash_cache",
+        help="File where content hashes are cached between runs, keyed by path and stat info. "
+        "Must be outside of the destination",
+    )
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Number of threads used to check and copy changed files",
+    )
+    parser.add_argument(
+        "--render-jobs",
+        dest="render_jobs",
+        type=int,
+        default=1,
+        help="Number of PlantUML diagrams and OpenAPI specs rendered at the same time",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action=argparse.BooleanOptionalAction,
+        help="Only look at files changed (according to git) since the previous incremental sync",
+    )
+    parser.add_argument(
+        "--since",
+        dest="since",
+        help="Only look at files changed (according to git) since the given revision",
+    )
+    parser.add_argument(
+        "--render-cache",
+        dest="render_cache",
+        help="Directory or s3:// URL where rendered PlantUML diagrams and bundled OpenAPI specs "
+        "are cached between runs",
+    )
     args = parser.parse_args()
 
-    if args.command == "copy":
-        try:
-            with FileIndexLoader.loaded(
-                os.path.join(args.to_path, INDEX_DIRECTORY), fs, not args.dry_run
-            ) as index:
-                config = ConfigLoader.default(args.from_path, args.to_path, fs).load(
-                    args.config_path, args.skip_invalid_documents
-                )
-                Copier(
-                    OperationDetectorChain(
-                        CopyDetector(
-                            args.from_path,
-                            args.to_path,
-                            args.author,
-                            args.branch,
-                            config,
-                        ),
-                        PlantUMLDiagramsDetector(),
-                        OpenAPIDetector(),
-                        DeleteDetector(args.index, index, args.from_path, args.to_path),
-                        UnnecessaryOperationsFilteringDetector(),
-                    ).operations(fs),
-                    fs,
-                    PrintingExecutor(formatter=RelativeFormatter(args.to_path, args.from_path))
-                    if args.dry_run
-                    else Executor(fs, formatter=RelativeFormatter(args.to_path, args.from_path)),
-                ).execute()
-        except ConfigError as e:
-            print(f"Config file load error: {e}")
-            sys.exit(1)
+    options = {
+        "--index": args.index,
+        "--from": args.from_path,
+        "--to": args.to_path,
+        "--config": args.config_path,
+        "--plan": args.plan_path,
+    }
+    required = {
+        "copy": ["--index", "--from", "--to", "--config"],
+        "plan": ["--index", "--from", "--to", "--config", "--plan"],
+        "apply": ["--plan"],
+        "merge": ["--plan"],
+        "show": ["--plan"],
+    }[args.command]
+    missing = [option for option in required if options[option] is None]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if args.hash_cache is not None and args.to_path is not None:
+        if os.path.abspath(args.hash_cache).startswith(os.path.abspath(args.to_path) + os.sep):
+            parser.error("--hash-cache must not be inside of the destination")
+
+    try:
+        {"copy": copy, "plan": plan, "apply": apply, "merge": merge, "show": show}[args.command](
+            args, fs
+        )
+    except ConfigError as e:
+        print(f"Config file load error: {e}")
+        sys.exit(1)
+    except PlanError as e:
+        print(f"Plan file load error: {e}")
+        sys.exit(1)
+    except RenderError as e:
+        print(f"Render error: {e}", file=sys.stderr)
+        sys.exit(1)
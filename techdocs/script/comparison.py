@@ -0,0 +1,59 @@
+import sys
+import threading
+from collections import Counter
+
+# The tiers, from the cheapest one, in the order they are tried
+MISSING = "missing"
+SIZE = "size"
+MTIME = "mtime"
+PARTIAL_HASH = "partial-hash"
+HASH = "hash"
+TIERS = (MISSING, SIZE, MTIME, PARTIAL_HASH, HASH)
+
+
+# Decides whether a file copied to the destination differs from its source, using the cheapest
+# check that can tell. Only a differing size proves a change without reading the files; matching
+# size and mtime are trusted to mean "unchanged" only if enabled, as mtimes may lie. Keeps a tally
+# of how many files were resolved by each tier.
+class TieredComparator:
+    PARTIAL_HASH_BYTES = 64 * 1024
+
+    def __init__(self, trust_mtime=False, partial_hash=False):
+        self.trust_mtime = trust_mtime
+        self.partial_hash = partial_hash
+        self.tally = Counter()
+        self._lock = threading.Lock()
+
+    def has_changes(self, fs, source_abs, destination_abs, source_stat=None):
+        try:
+            destination_stat = fs.stat(destination_abs)
+        except FileNotFoundError:
+            return self._resolved(MISSING, True)
+        source_stat = source_stat or fs.stat(source_abs)
+        if source_stat.size != destination_stat.size:
+            return self._resolved(SIZE, True)
+        if self.trust_mtime and source_stat.mtime_ns == destination_stat.mtime_ns:
+            return self._resolved(MTIME, False)
+        if self.partial_hash and source_stat.size > self.PARTIAL_HASH_BYTES:
+            if self._partial_digest(fs, source_abs) != self._partial_digest(fs, destination_abs):
+                return self._resolved(PARTIAL_HASH, True)
+        return self._resolved(HASH, fs.digest(source_abs) != fs.digest(destination_abs))
+
+    # sha256 of the beginning of the file, cached like full hashes when there is a hash cache
+    def _partial_digest(self, fs, file):
+        return fs.digest(file, "sha256-head", head=self.PARTIAL_HASH_BYTES)
+
+    def report(self, file=sys.stderr):
+        if not self.tally:
+            return
+        print(
+            f"Compared {sum(self.tally.values())} files, resolved by: "
+            + ", ".join(f"{tier}={self.tally[tier]}" for tier in TIERS),
+            file=file,
+        )
+
+    def _resolved(self, tier, changed):
+        # operations may be checked concurrently, see UnnecessaryOperationsFilteringDetector
+        with self._lock:
+            self.tally[tier] += 1
+        return changed
@@ -37,7 +37,8 @@ class ConfigValidator(abc.ABC):
 
 class ConfigLoader:
     @classmethod
-    def default(cls, from_path, to_path, filesystem) -> "ConfigLoader":
+    def default(cls, from_path, to_path, filesystem, project_reader=None) -> "ConfigLoader":
+        project_reader = project_reader or ProjectDetailsReader(to_path, filesystem)
         return cls(
             filesystem,
             [DocumentsKeyMustExist(), DocumentsKeyMustBeList()],
@@ -50,7 +51,7 @@ class ConfigLoader:
                 WildardsInTheMiddleAreApplicableOnlyToDirectories(),
                 IfSourceIsDirectoryThenDestinationMustAlsoBeDirectory(),
                 ProjectKeyMustExist(),
-                ProjectMustExist(ProjectDetailsReader(to_path, filesystem)),
+                ProjectMustExist(project_reader),
                 PathMustNotBeAbsolute("source"),
                 PathMustNotBeAbsolute("destination"),
             ],
@@ -211,23 +212,29 @@ class WildardsInTheMiddleAreApplicableOnlyToDirectories(ConfigValidator):
 
 
 # Reads the projects.json file and returns the path to the project's docs directory in Tech-docs repository
+# The file is parsed once and re-read only when its modification time changes, so a single reader
+# can be shared by config validation and all the detectors for the whole run.
 class ProjectDetailsReader:
     def __init__(self, directory, filesystem):
         self.directory = directory
         self.filesystem = filesystem
         self._projects = None
+        self._mtime_ns = None
 
     def doc_path(self, project):
-        if project not in self.projects:
+        # projects.json is checked for changes once per call
+        projects = self.projects
+        if project not in projects:
             raise ProjectDoesNotExist(f"Project {project} does not exist")
-        return self.projects[project]["path"]
+        return projects[project]["path"]
 
     @property
     def projects(self):
-        if not self._projects:
-            self._projects = json.loads(
-                self.filesystem.read_string(path.join(self.directory, "projects.json"))
-            )
+        projects_file = path.join(self.directory, "projects.json")
+        mtime_ns = self.filesystem.stat(projects_file).mtime_ns
+        if self._projects is None or mtime_ns != self._mtime_ns:
+            self._projects = json.loads(self.filesystem.read_string(projects_file))
+            self._mtime_ns = mtime_ns
         return self._projects
 
 
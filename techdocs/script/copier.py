@@ -1,7 +1,22 @@
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 from pathlib import Path
 
+from operations import (
+    GenericFileCopyOperation,
+    OpenAPIOperation,
+    PlantUMLDiagramRenderOperation,
+    YAMLPrefaceEnrichingCopyOperation,
+)
+
+# Operations that only read their source and write their own destination, in any order
+INDEPENDENT_OPERATIONS = (GenericFileCopyOperation, YAMLPrefaceEnrichingCopyOperation)
+# Operations that run external renderers, each writing its own destination
+RENDER_OPERATIONS = (PlantUMLDiagramRenderOperation, OpenAPIOperation)
+
 
 class Copier:
     def __init__(self, operations, filesystem, executor=None) -> None:
@@ -14,24 +29,152 @@ class Copier:
         if len(operations) == 0:
             print("Nothing to do", file=sys.stderr)
             return
-        for operation in operations:
-            self.executor.execute(operation)
+        self.executor.execute_all(operations)
 
 
 class Executor:
-    def __init__(self, filesystem, formatter=None):
+    def __init__(self, filesystem, formatter=None, render_jobs=1):
         self.formatter = formatter or SimpleFormatter()
         self.filesystem = filesystem
+        self.render_jobs = render_jobs
+
+    # The operations are executed in their original order (copies, renders, deletes), consecutive
+    # renders by a RenderPool. A failed render stops the operations after it, so nothing is deleted.
+    def execute_all(self, operations):
+        prefetch(self.filesystem, operations)
+        for renders, group in groupby(
+            operations, lambda operation: isinstance(operation, RENDER_OPERATIONS)
+        ):
+            if renders:
+                RenderPool(self.filesystem, self.render_jobs, self.formatter).execute_all(
+                    list(group)
+                )
+            else:
+                self.execute_operations(list(group))
+
+    def execute_operations(self, operations):
+        for operation in operations:
+            self.execute(operation)
 
     def execute(self, operation):
         print(operation.mkd(self.formatter))
         operation.execute(self.filesystem)
 
 
+# Runs consecutive independent copy operations concurrently, everything else but renders (deletes)
+# one by one, in the original order. The operations are printed in the original order too.
+class ParallelExecutor(Executor):
+    def __init__(self, filesystem, jobs, formatter=None, render_jobs=1):
+        super().__init__(filesystem, formatter, render_jobs)
+        self.jobs = jobs
+
+    def execute_operations(self, operations):
+        for batch in independent_batches(operations):
+            if len(batch) == 1:
+                self.execute(batch[0])
+                continue
+            for operation in batch:
+                print(operation.mkd(self.formatter))
+            for directory in sorted(
+                {os.path.dirname(f) for operation in batch for f in operation.destination_files()}
+            ):
+                self.filesystem.makedirs(directory)
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                list(pool.map(lambda operation: operation.execute(self.filesystem), batch))
+
+
+# Splits the operations into batches that can be executed concurrently: runs of consecutive
+# independent operations, each writing different files. Other operations form single-item batches.
+def independent_batches(operations):
+    batch, destinations = [], set()
+    for operation in operations:
+        if not isinstance(operation, INDEPENDENT_OPERATIONS):
+            if batch:
+                yield batch
+            yield [operation]
+            batch, destinations = [], set()
+            continue
+        if destinations & set(operation.destination_files()):
+            yield batch
+            batch, destinations = [], set()
+        batch.append(operation)
+        destinations.update(operation.destination_files())
+    if batch:
+        yield batch
+
+
+class RenderError(Exception):
+    pass
+
+
+# Runs render operations on up to `jobs` threads. A failed render doesn't stop the others, the
+# failures are raised together once all the renders are done. How long each render took is
+# printed to stderr.
+class RenderPool:
+    def __init__(self, filesystem, jobs=1, formatter=None):
+        self.filesystem = filesystem
+        self.jobs = jobs
+        self.formatter = formatter or SimpleFormatter()
+
+    def execute_all(self, operations):
+        for operation in operations:
+            print(operation.mkd(self.formatter))
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            failures = [failure for failure in pool.map(self._render, operations) if failure]
+        if failures:
+            raise RenderError(
+                f"{len(failures)} of {len(operations)} renders failed:\n"
+                + "\n".join(f"{source}: {error}" for source, error in failures)
+            )
+
+    # Returns the rendered source and the error if the render failed
+    def _render(self, operation):
+        source = self.formatter.format(operation.source_files()[0])
+        start = time.monotonic()
+        try:
+            operation.execute(self.filesystem)
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            print(f"Render of {source} failed after {elapsed:.2f}s", file=sys.stderr)
+            return source, e
+        print(f"Rendered {source} in {time.monotonic() - start:.2f}s", file=sys.stderr)
+        return None
+
+
+# Lets the PlantUML generators and OpenAPI tools process all the pending diagrams and specs up
+# front, in one go, instead of one by one
+def prefetch(fs, operations):
+    pending = {}
+    for operation in operations:
+        if isinstance(operation, PlantUMLDiagramRenderOperation):
+            tools, item = [operation.generator], operation.source_puml_abs
+        elif isinstance(operation, OpenAPIOperation):
+            item = (operation.source_abs, operation.ref_files, operation.destination_abs)
+            # Validated before being bundled, same as in OpenAPIOperation.execute
+            tools = [operation.validator, operation.bundler]
+        else:
+            continue
+        for tool in tools:
+            if hasattr(tool, "prefetch"):
+                pending.setdefault(tool, []).append(item)
+    for tool, items in pending.items():
+        start = time.monotonic()
+        tool.prefetch(fs, items)
+        print(
+            f"Prefetched {len(items)} renders with {type(tool).__name__} in "
+            f"{time.monotonic() - start:.2f}s",
+            file=sys.stderr,
+        )
+
+
 class PrintingExecutor:
     def __init__(self, formatter=None):
         self.formatter = formatter or SimpleFormatter()
 
+    def execute_all(self, operations):
+        for operation in operations:
+            self.execute(operation)
+
     def execute(self, operation):
         print(operation.mkd(self.formatter))
 
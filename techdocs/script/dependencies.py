@@ -0,0 +1,53 @@
+import json
+from os import path
+
+from index import index_file
+
+
+# Which source files each rendered output (PlantUML diagram, OpenAPI spec) is built from, besides
+# its own source: the included and $ref'd files, transitively. Paths are relative to the source
+# repository, so the graph can be combined with the files git reports as changed.
+class DependencyGraph:
+    def __init__(self, root, edges=None):
+        self.root = root
+        self.edges = {consumer: set(files) for consumer, files in (edges or {}).items()}
+
+    # Replaces what is known about `consumer_abs`, which depends on `dependencies_abs`
+    def record(self, consumer_abs, dependencies_abs):
+        self.edges[self._relative(consumer_abs)] = {
+            self._relative(file) for file in dependencies_abs
+        }
+
+    def forget(self, consumers):
+        for consumer in consumers:
+            self.edges.pop(consumer, None)
+
+    # Outputs that have to be built again when `files` change
+    def dependents(self, files):
+        files = set(files)
+        return {consumer for consumer, dependencies in self.edges.items() if dependencies & files}
+
+    def _relative(self, file_abs):
+        return path.relpath(file_abs, self.root)
+
+
+class DependencyGraphLoader:
+    SUFFIX = ".deps.json"
+
+    @classmethod
+    def load(cls, fspath, repo, fs, root):
+        try:
+            content = json.loads(fs.read_string(index_file(fspath, repo, cls.SUFFIX)))
+        except (FileNotFoundError, ValueError):
+            return None
+        return DependencyGraph(root, content)
+
+    @classmethod
+    def save(cls, graph, fspath, repo, fs):
+        fs.write_string(
+            index_file(fspath, repo, cls.SUFFIX), json.dumps(serialize(graph), indent=2)
+        )
+
+
+def serialize(graph):
+    return {consumer: sorted(files) for consumer, files in sorted(graph.edges.items())}
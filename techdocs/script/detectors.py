@@ -1,12 +1,12 @@
-import copy
 import io
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 
 import nodes
 from config import Config, ProjectDetailsReader
-from filesystem import Filesystem
+from filesystem import FileEntry, Filesystem
 from index import FileIndexItem
 from operations import (
     DeleteOperation,
@@ -14,6 +14,7 @@ from operations import (
     GenericFileCopyOperation,
     OpenAPIValidator,
     PlantUMLDiagramRenderOperation,
+    PlantUMLIncludeResolver,
     YAMLPrefaceEnrichingCopyOperation,
 )
 from operations import OpenAPIBundler, OpenAPIOperation
@@ -21,7 +22,15 @@ from operations import OpenAPIBundler, OpenAPIOperation
 
 class CopyDetector:
     def __init__(
-            self, from_path: str, to_path: str, author: str, branch: str, config: Config
+            self,
+            from_path: str,
+            to_path: str,
+            author: str,
+            branch: str,
+            config: Config,
+            project_reader=None,
+            comparator=None,
+            paths=None,
     ) -> None:
         self.copy_rules = [
             Rule(
@@ -31,25 +40,54 @@ class CopyDetector:
             )
             for document_rule in config.documents
         ]
+        self.rule_set = RuleSet(self.copy_rules)
         self.from_path = from_path
         self.to_path = to_path
         self.author = author
         self.branch = branch
+        self.project_reader = project_reader
+        self.comparator = comparator
+        # If set, only these files (relative to from_path) are considered instead of walking the
+        # whole tree, see incremental.py
+        self.paths = paths
 
     def detect(self, fs, previous_operations):
-        return [
-            self._for_file(fs, file)
-            for file in fs.scan(self.from_path, ".*")
-            if self._for_file(fs, file) is not None
-        ]
+        operations = []
+        for entry, rule in self.matches(fs):
+            operation = self._create_operation(fs, entry.path, rule, entry.stat)
+            if operation is not None:
+                operations.append(operation)
+        return operations
 
-    def _for_file(self, fs, path: str):
-        for rule in self.copy_rules:
-            if rule.match(path):
-                return self._create_operation(fs, path, rule)
-        return None
+    def matches(self, fs):
+        """Yields (entry, rule) pairs for every walked file matched by one of the copy rules"""
+        for entry in self._entries(fs):
+            rule = self.rule_set.match(entry.path)
+            if rule is not None:
+                yield entry, rule
+
+    def destinations(self, fs, files):
+        """Paths, relative to to_path, that the given source files are (or would be) copied to"""
+        destinations = set()
+        for file in files:
+            rule = self.rule_set.match(file)
+            operation = self._create_operation(fs, file, rule) if rule is not None else None
+            if operation is not None:
+                destination = path.relpath(operation.destination_abs, self.to_path)
+                destinations.update(derived_destinations(destination))
+        return destinations
+
+    def _entries(self, fs):
+        if self.paths is None:
+            yield from fs.walk(self.from_path, self.rule_set.may_contain)
+            return
+        for file in sorted(self.paths):
+            try:
+                yield FileEntry(file, fs.stat(path.join(self.from_path, file)))
+            except FileNotFoundError:
+                continue
 
-    def _create_operation(self, fs, file, rule):
+    def _create_operation(self, fs, file, rule, source_stat=None):
         if nodes.looks_fileish(rule.config.source) and nodes.looks_dirish(rule.config.destination):
             destination_file = path.basename(file)
             if nodes.looks_globish(rule.config.source):
@@ -79,7 +117,7 @@ class CopyDetector:
             destination_abs=path.abspath(
                 path.join(
                     self.to_path,
-                    ProjectDetailsReader(self.to_path, fs).doc_path(rule.config.project),
+                    self._project_reader(fs).doc_path(rule.config.project),
                     relative_dst,
                 ),
             ),
@@ -88,7 +126,14 @@ class CopyDetector:
             return YAMLPrefaceEnrichingCopyOperation(
                 **dict(**kwargs, from_abs=self.from_path, author=self.author, branch=self.branch)
             )
-        return GenericFileCopyOperation(**kwargs)
+        return GenericFileCopyOperation(
+            **kwargs, source_stat=source_stat, comparator=self.comparator
+        )
+
+    def _project_reader(self, fs):
+        if self.project_reader is None:
+            self.project_reader = ProjectDetailsReader(self.to_path, fs)
+        return self.project_reader
 
 
 class DefaultMatcher:
@@ -105,52 +150,127 @@ class Rule:
         self.config = document_config_rule
         self.matcher = matcher
         self.excluders = excluders
+        self._excluder = (
+            re.compile("|".join(f"(?:{excluder.regex})" for excluder in excluders))
+            if excluders
+            else None
+        )
 
     def match(self, file):
-        return self.matcher.match(file) and not (
-            any([excluder.match(file) for excluder in self.excluders])
-        )
+        return self.matcher.match(file) and not self.excluded(file)
+
+    # Whether any file in the given directory (relative, with trailing slash) can match the rule.
+    # The static part of the source pattern, up to the first wildcard, must lead to or contain the
+    # directory, and the directory must not be excluded as a whole. Since the patterns are prefix
+    # matches, an exclude that matches the directory path excludes every file below it.
+    def may_contain(self, directory):
+        if not (self.prefix.startswith(directory) or directory.startswith(self.prefix)):
+            return False
+        return not self.excluded(directory)
+
+    @property
+    def prefix(self):
+        return self.config.source.split("*")[0]
+
+    def excluded(self, file):
+        if self._excluder is None:
+            return False
+        return self._excluder.match(file) is not None
+
+
+# Matches paths against all the rules at once, using a single combined regex. The first rule (in
+# config order) whose pattern matches and that does not exclude the path wins, same as checking
+# the rules one by one.
+class RuleSet:
+    def __init__(self, rules) -> None:
+        self.rules = rules
+        # Combined regexes for rules[i:], built lazily - they are needed only when a path is
+        # excluded by a rule that matched it, so that the remaining rules have to be consulted
+        self._automata = {}
+
+    def match(self, file):
+        start = 0
+        while start < len(self.rules):
+            found = self._automaton(start).match(file)
+            if found is None:
+                return None
+            index = start + int(found.lastgroup[1:])
+            rule = self.rules[index]
+            if not rule.excluded(file):
+                return rule
+            start = index + 1
+        return None
+
+    def may_contain(self, directory):
+        return any(rule.may_contain(directory) for rule in self.rules)
+
+    def _automaton(self, start):
+        if start not in self._automata:
+            self._automata[start] = re.compile(
+                "|".join(
+                    f"(?P<r{i}>{rule.matcher.regex})" for i, rule in enumerate(self.rules[start:])
+                )
+            )
+        return self._automata[start]
 
 
 class DeleteDetector:
-    def __init__(self, repo, index, from_path, to_path) -> None:
+    # If `scope` is set, only the indexed files it contains may be deleted. Used by incremental
+    # syncs, which don't see all the files a repository provides.
+    def __init__(self, repo, index, from_path, to_path, scope=None) -> None:
         self.repo = repo
         self.index = index
         self.from_path = from_path
         self.to_path = to_path
+        self.scope = scope
 
     def detect(self, fs, previous_operations):
-        child_result = previous_operations
-        child_result_files_to_be_copied = [
-            path.relpath(j, self.to_path)
-            for sub in [o.destination_files() for o in child_result]
-            for j in sub
-        ]
-        indexed_items = list([i for i in self.index.items if i.repo == self.repo])
-        for item in indexed_items:
-            if item.file not in child_result_files_to_be_copied:
-                child_result.append(
-                    DeleteOperation(
-                        path.abspath(
-                            path.join(self.to_path, item.file),
-                        )
-                    )
-                )
-                self.index.remove(item)
-
-        for item in child_result_files_to_be_copied:
-            self.index.add(FileIndexItem(item, self.repo))
+        child_result = list(previous_operations)
+        # Files to be written by this run, relative to the destination, unique and in order
+        files_to_be_copied = dict.fromkeys(
+            path.relpath(f, self.to_path) for o in child_result for f in o.destination_files()
+        )
+        deleted, added = index_diff(self.index.items_for(self.repo), files_to_be_copied)
+        if self.scope is not None:
+            deleted = [item for item in deleted if item.file in self.scope]
+        for item in deleted:
+            child_result.append(DeleteOperation(path.abspath(path.join(self.to_path, item.file))))
+            self.index.remove(item)
+        for file in added:
+            self.index.add(FileIndexItem(file, self.repo))
         return child_result
 
 
+# Compares the indexed items of a repository with the files it currently provides. Returns the items
+# that are no longer provided and the files that are not indexed yet.
+def index_diff(indexed_items, current_files):
+    indexed_files = {item.file for item in indexed_items}
+    return (
+        [item for item in indexed_items if item.file not in current_files],
+        [file for file in current_files if file not in indexed_files],
+    )
+
+
 class UnnecessaryOperationsFilteringDetector:
+    # has_changes is I/O bound, with jobs > 1 the operations are checked by a pool of threads. The
+    # order of the operations is kept either way.
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+
     def detect(self, fs, previous_operations):
-        return list(filter(lambda op: op.has_changes(fs), previous_operations))
+        if self.jobs <= 1:
+            return list(filter(lambda op: op.has_changes(fs), previous_operations))
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            changes = list(pool.map(lambda op: op.has_changes(fs), previous_operations))
+        return [op for op, changed in zip(previous_operations, changes) if changed]
 
 
 class PlantUMLDiagramsDetector:
-    def __init__(self, generator=None):
+    def __init__(self, generator=None, resolver=None, dependencies=None):
         self.generator = generator or DockerPlantUMLGenerator()
+        self.resolver = resolver or PlantUMLIncludeResolver()
+        # DependencyGraph to record the diagrams' includes in, if any
+        self.dependencies = dependencies
 
     def detect(self, fs, previous_operations):
         pumls = list(
@@ -159,6 +279,11 @@ class PlantUMLDiagramsDetector:
                 previous_operations,
             )
         )
+        if self.dependencies is not None:
+            for puml in pumls:
+                self.dependencies.record(
+                    puml.source_abs, self.resolver.includes(fs, puml.source_abs)
+                )
         return list(
             filter(
                 lambda op: not any([f.endswith(".puml") for f in op.source_files()]),
@@ -169,25 +294,38 @@ class PlantUMLDiagramsDetector:
                 puml.source_abs,
                 swap_extension(puml.destination_abs, "svg"),
                 self.generator,
+                self.resolver,
             )
             for puml in pumls
         ]
 
 
+# Files copied to `destination` may end up in the destination under a different name, once
+# rendered by the PlantUML or OpenAPI detectors
+def derived_destinations(destination):
+    if destination.endswith(".puml"):
+        return [destination, swap_extension(destination, "svg")]
+    if destination.endswith((".yaml", ".yml")):
+        return [destination, swap_extension(destination, "json")]
+    return [destination]
+
+
 def swap_extension(file_path: str, new_extension: str) -> str:
     base_name = path.splitext(file_path)[0]
     return f"{base_name}.{new_extension}"
 
 
+# Each detector gets the previous detector's operations as a tuple, so it can't alter them, and
+# returns a new list. The operations themselves are shared, not copied, between the detectors.
 class OperationDetectorChain:
     def __init__(self, *detectors):
         self.detectors = detectors
 
     def operations(self, fs):
-        operations = []
+        operations = ()
         for detector in self.detectors:
-            operations = detector.detect(fs, copy.deepcopy(operations))
-        return operations
+            operations = tuple(detector.detect(fs, operations))
+        return list(operations)
 
 
 class OpenAPIFile:
@@ -198,14 +336,25 @@ class OpenAPIFile:
 
 
 class OpenAPIDetector:
-    def __init__(self, bundler=None, validator=None):
+    # How much of a file is looked at to tell whether it may be a spec
+    SNIFF_BYTES = 64 * 1024
+
+    def __init__(self, bundler=None, validator=None, dependencies=None):
         self.bundler = bundler or OpenAPIBundler()
         self.validator = validator or OpenAPIValidator()
+        # DependencyGraph to record the specs' $refs in, if any
+        self.dependencies = dependencies
+        # Files read and parsed during the run, shared by spec detection and reference collection
+        self._texts = {}
+        self._documents = {}
 
     def detect(self, fs: Filesystem, previous_operations):
         openapi_spec_files = self._detect_yaml_files(
             fs, previous_operations
         ) + self._detect_json_files(fs, previous_operations)
+        if self.dependencies is not None:
+            for spec in openapi_spec_files:
+                self.dependencies.record(spec.source_abs, spec.ref_files)
 
         filtered_operations = [
             op
@@ -224,7 +373,6 @@ class OpenAPIDetector:
                 spec.ref_files,
                 self.bundler,
                 self.validator,
-                filtered_operations,
             )
             for spec in openapi_spec_files
         ]
@@ -240,7 +388,9 @@ class OpenAPIDetector:
         openapi_spec_files = []
 
         for yaml_op in yaml_ops:
-            file = io.StringIO(fs.read_string(yaml_op.source_abs))
+            if not fs.read_bytes(yaml_op.source_abs, self.SNIFF_BYTES).startswith(b"openapi:"):
+                continue
+            file = io.StringIO(self._read(fs, yaml_op.source_abs))
             if file.readline().startswith("openapi:"):
                 if any(line.startswith("paths:\n") for line in file):
                     destination = yaml_op.destination_abs.replace(
@@ -264,10 +414,9 @@ class OpenAPIDetector:
         openapi_spec_files = []
 
         for json_op in json_ops:
-            try:
-                data = json.loads(fs.read_string(json_op.source_abs))
-            except json.JSONDecodeError:
-                continue  # Not valid JSON, skip
+            if not self._may_be_spec(fs, json_op.source_abs):
+                continue
+            data = self._parse(fs, json_op.source_abs)
 
             if isinstance(data, dict) and data.get("openapi") and data.get("paths"):
                 visited = set()
@@ -290,7 +439,7 @@ class OpenAPIDetector:
             return []
 
     def _collect_yaml_references(self, fs, file_abs, visited):
-        content = fs.read_string(file_abs)
+        content = self._read(fs, file_abs)
         lines = content.split("\n")
         base_dir = path.dirname(file_abs)
         abs_refs = []
@@ -308,9 +457,8 @@ class OpenAPIDetector:
         return list(set(abs_refs + all_nested))
 
     def _collect_json_references(self, fs, file_abs, visited):
-        try:
-            data = json.loads(fs.read_string(file_abs))
-        except json.JSONDecodeError:
+        data = self._parse(fs, file_abs)
+        if data is None:
             return []
 
         base_dir = path.dirname(file_abs)
@@ -336,6 +484,30 @@ class OpenAPIDetector:
 
         return list(set(abs_refs + all_nested))
 
+    # Tells whether a JSON file may be a spec without parsing it: specs contain the "openapi" key,
+    # usually at the very beginning
+    def _may_be_spec(self, fs, file_abs):
+        head = fs.read_bytes(file_abs, self.SNIFF_BYTES)
+        if b'"openapi"' in head:
+            return True
+        if len(head) < self.SNIFF_BYTES:
+            return False
+        return b'"openapi"' in fs.read_bytes(file_abs)
+
+    def _read(self, fs, file_abs):
+        if file_abs not in self._texts:
+            self._texts[file_abs] = fs.read_string(file_abs)
+        return self._texts[file_abs]
+
+    # Returns the parsed JSON file, None if it is not valid JSON
+    def _parse(self, fs, file_abs):
+        if file_abs not in self._documents:
+            try:
+                self._documents[file_abs] = json.loads(self._read(fs, file_abs))
+            except json.JSONDecodeError:
+                self._documents[file_abs] = None
+        return self._documents[file_abs]
+
     def get_nested_references(self, abs_refs, file_abs, fs, visited):
         all_nested = []
         for ref in abs_refs:
@@ -1,22 +1,60 @@
+import itertools
 import os
 import re
 import shutil
+from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
+from typing import Union
+
+from hash import hashb
+
+
+@dataclass(frozen=True)
+class FileStat:
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+@dataclass(frozen=True)
+class FileEntry:
+    path: str  # relative to the walked directory
+    # The file's FileStat, or the os.DirEntry it was walked as, which is only stat'ed when needed
+    source: Union[FileStat, os.DirEntry]
+
+    @cached_property
+    def stat(self):
+        if isinstance(self.source, FileStat):
+            return self.source
+        result = self.source.stat()
+        return FileStat(result.st_size, result.st_mtime_ns, result.st_ino)
 
 
 class Filesystem:
+    def __init__(self, hash_cache=None):
+        self.hash_cache = hash_cache
+        # Directories known to exist, so that they are created only once per run
+        self._directories = set()
+
     def is_file(self, fspath):
         return os.path.isfile(fspath)
 
     def is_dir(self, fspath):
         return os.path.isdir(fspath)
 
+    def makedirs(self, directory):
+        if directory not in self._directories:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            self._directories.add(directory)
+
     def copy(self, source, destination):
-        Path(os.path.dirname(destination)).mkdir(parents=True, exist_ok=True)
-        shutil.copy(source, destination)
+        self.makedirs(os.path.dirname(destination))
+        # copy2 preserves the modification time, so that the copies can be compared by mtime
+        shutil.copy2(source, destination)
 
     def write_string(self, file, content):
-        Path(os.path.dirname(file)).mkdir(parents=True, exist_ok=True)
+        self.makedirs(os.path.dirname(file))
         with open(file, "w") as f:
             f.write(content)
 
@@ -24,26 +62,70 @@ class Filesystem:
         with open(file) as f:
             return f.read()
 
-    def read_bytes(self, file):
+    def read_bytes(self, file, limit=None):
+        with open(file, "rb") as f:
+            return f.read(-1 if limit is None else limit)
+
+    # Returns the last `size` bytes of the file
+    def read_tail(self, file, size):
         with open(file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - size))
             return f.read()
 
     def delete(self, file):
         os.remove(file)
 
-    def scan(self, directory, regex):
+    # Returns fn(file content), by default its sha256, consulting the hash cache if there is one.
+    # With `head` or `tail`, fn only gets the first `head` or the last `tail` bytes of the file.
+    def digest(self, file, name="sha256", fn=hashb, head=None, tail=None):
+        if self.hash_cache is not None:
+            return self.hash_cache.digest(self, file, name, fn, head, tail)
+        return fn(self.read_bytes(file, head) if tail is None else self.read_tail(file, tail))
+
+    def stat(self, file):
+        result = os.stat(file)
+        return FileStat(result.st_size, result.st_mtime_ns, result.st_ino)
+
+    def scan(self, directory, regex, descend=None):
         return [
-            os.path.join(dp, f)[len(directory) + (0 if directory.endswith("/") else 1) :]
-            for dp, _, filenames in os.walk(directory)
-            for f in filenames
-            if re.match(regex, f)
+            entry.path
+            for entry in self.walk(directory, descend)
+            if re.match(regex, os.path.basename(entry.path))
         ]
 
+    # Lazily yields a FileEntry for every file below `directory`, depth first, in the same order as
+    # os.walk. The stat info comes from the os.scandir entries when first accessed, so files that
+    # callers skip are never stat'ed and the others aren't stat'ed twice. If `descend` is given,
+    # it's called with every subdirectory's path relative to `directory` (with a trailing slash)
+    # and the subdirectory is skipped when it returns False.
+    def walk(self, directory, descend=None):
+        prefix_length = len(directory) + (0 if directory.endswith("/") else 1)
+        pending = [directory]
+        while pending:
+            subdirectories = []
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if descend is None or descend(entry.path[prefix_length:] + "/"):
+                                subdirectories.append(entry.path)
+                        elif entry.is_file():
+                            yield FileEntry(entry.path[prefix_length:], entry)
+            except OSError:
+                # Same as os.walk, unreadable directories are skipped
+                continue
+            pending.extend(reversed(subdirectories))
+
 
 class MockFilesystem:
-    def __init__(self, files: dict, relpath: str = "/"):
+    def __init__(self, files: dict, relpath: str = "/", hash_cache=None):
         self.relpath = relpath
         self.files = files
+        self.hash_cache = hash_cache
+        # Fake modification times, bumped on every write, so that mtime-based caches can be tested
+        self.mtimes = {}
+        self._clock = itertools.count(1)
 
     def is_file(self, fspath):
         return fspath in self.files
@@ -51,32 +133,66 @@ class MockFilesystem:
     def is_dir(self, fspath):
         return any([f.startswith(fspath) for f in self.files])
 
+    def makedirs(self, directory):
+        pass
+
     def copy(self, source, destination):
         if source not in self.files:
             raise FileNotFoundError(f"File {source} not found")
         self.files[destination] = self.files[source]
+        self.mtimes[destination] = self.mtimes.get(source, 0)
 
     def write_string(self, file, content):
         self.files[file] = content
+        self.mtimes[file] = next(self._clock)
 
     def read_string(self, file):
         if file not in self.files:
             raise FileNotFoundError(f"File {file} not found")
         return self.files[file]
 
-    def read_bytes(self, file):
+    def read_bytes(self, file, limit=None):
+        if file not in self.files:
+            raise FileNotFoundError(f"File {file} not found")
+        return self.files[file].encode()[:limit]
+
+    def read_tail(self, file, size):
         if file not in self.files:
             raise FileNotFoundError(f"File {file} not found")
-        return self.files[file].encode()
+        return self.files[file].encode()[-size:]
 
     def delete(self, file):
         if file not in self.files:
             raise FileNotFoundError(f"File {file} not found")
         del self.files[file]
+        self.mtimes.pop(file, None)
+
+    def digest(self, file, name="sha256", fn=hashb, head=None, tail=None):
+        if self.hash_cache is not None:
+            return self.hash_cache.digest(self, file, name, fn, head, tail)
+        return fn(self.read_bytes(file, head) if tail is None else self.read_tail(file, tail))
 
-    def scan(self, directory, regex):
+    def stat(self, file):
+        if file not in self.files:
+            raise FileNotFoundError(f"File {file} not found")
+        return FileStat(len(self.files[file].encode()), self.mtimes.get(file, 0), 0)
+
+    def scan(self, directory, regex, descend=None):
         return [
-            f[len(directory) + (0 if directory.endswith("/") else 1) :]
-            for f in self.files.keys()
-            if f.startswith(directory) and re.match(regex, f)
+            entry.path
+            for entry in self.walk(directory, descend)
+            if re.match(regex, os.path.join(directory, entry.path))
         ]
+
+    def walk(self, directory, descend=None):
+        prefix_length = len(directory) + (0 if directory.endswith("/") else 1)
+        for f in list(self.files.keys()):
+            if f.startswith(directory) and (
+                descend is None or _descends(f[prefix_length:], descend)
+            ):
+                yield FileEntry(f[prefix_length:], self.stat(f))
+
+
+def _descends(relative_file, descend):
+    parts = relative_file.split("/")[:-1]
+    return all(descend("/".join(parts[: i + 1]) + "/") for i in range(len(parts)))
@@ -1,5 +1,74 @@
+import json
+from contextlib import contextmanager
 from hashlib import sha256
 
 
 def hashb(data):
     return sha256(data).hexdigest()
+
+
+# Same as read_string() - decodes the content with newlines translated as in text mode
+def decode_text(data):
+    return data.decode().replace("\r\n", "\n").replace("\r", "\n")
+
+
+# Same as hashb(read_string().encode()) - the content is hashed as read in text mode
+def hashb_text(data):
+    return hashb(decode_text(data).encode())
+
+
+# Remembers digests of files, keyed by the file's path, size, mtime and inode, so that unchanged
+# files don't have to be read again. Besides plain content hashes it can hold any other value
+# derived from the file's content, under a different name.
+class HashCache:
+    def __init__(self, entries: dict = None):
+        self.entries = entries or {}
+
+    def digest(self, fs, file, name, fn, head=None, tail=None):
+        stat = fs.stat(file)
+        key = f"{name}:{file}"
+        fingerprint = [stat.size, stat.mtime_ns, stat.inode]
+        cached = self.entries.get(key)
+        if cached is not None and cached[:3] == fingerprint:
+            return cached[3]
+        value = fn(fs.read_bytes(file, head) if tail is None else fs.read_tail(file, tail))
+        self.entries[key] = fingerprint + [value]
+        return value
+
+    def prune(self, fs):
+        for key in list(self.entries):
+            if not fs.is_file(key.split(":", 1)[1]):
+                del self.entries[key]
+
+
+# The cache is stored in the file given by `--hash-cache`, if any. It must not be stored in the
+# destination, as its keys are paths and stat info of a single checkout.
+class HashCacheLoader:
+    VERSION = 1
+
+    @classmethod
+    def load(cls, fspath, fs):
+        if fspath is None:
+            return HashCache()
+        try:
+            content = json.loads(fs.read_string(fspath))
+        except (FileNotFoundError, ValueError):
+            return HashCache()
+        if content.get("version") != cls.VERSION:
+            return HashCache()
+        return HashCache(content["entries"])
+
+    @classmethod
+    def save(cls, cache, fspath, fs):
+        cache.prune(fs)
+        fs.write_string(
+            fspath, json.dumps({"version": cls.VERSION, "entries": cache.entries}, sort_keys=True)
+        )
+
+    @classmethod
+    @contextmanager
+    def loaded(cls, fspath, fs, save=True):
+        cache = cls.load(fspath, fs)
+        yield cache
+        if save and fspath is not None:
+            cls.save(cache, fspath, fs)
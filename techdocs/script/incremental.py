@@ -0,0 +1,130 @@
+import json
+import subprocess
+import sys
+from dataclasses import dataclass
+
+from hash import hashb
+from index import index_file
+
+# Files that other files can include or reference (PlantUML includes, OpenAPI $refs). A change to
+# one of them may affect outputs whose own sources did not change, which ones is only known from a
+# DependencyGraph.
+DEPENDENCY_SUFFIXES = (".puml", ".yaml", ".yml", ".json")
+
+
+@dataclass
+class GitChanges:
+    changed: set  # added, modified and renamed-to files, relative to the repository path
+    deleted: set  # deleted and renamed-from files
+
+
+class Git:
+    def __init__(self, runner=subprocess.run):
+        self.runner = runner
+
+    def head(self, repo_path):
+        output = self.runner(["git", "-C", repo_path, "rev-parse", "HEAD"], capture_output=True)
+        if output.returncode != 0:
+            return None
+        return output.stdout.decode().strip()
+
+    # Returns None if the changes can't be determined, e.g. the revision is not known to the
+    # (possibly shallow) clone
+    def changes_since(self, repo_path, revision):
+        output = self.runner(
+            [
+                "git",
+                "-C",
+                repo_path,
+                "diff",
+                "--relative",
+                "--name-status",
+                "--find-renames",
+                "-z",
+                revision,
+                "HEAD",
+            ],
+            capture_output=True,
+        )
+        if output.returncode != 0:
+            return None
+        changes = GitChanges(set(), set())
+        fields = output.stdout.decode().split("\0")
+        i = 0
+        while i < len(fields) - 1:
+            status = fields[i]
+            if status[0] in "RC":
+                if status[0] == "R":
+                    changes.deleted.add(fields[i + 1])
+                changes.changed.add(fields[i + 2])
+                i += 3
+                continue
+            (changes.deleted if status[0] == "D" else changes.changed).add(fields[i + 1])
+            i += 2
+        return changes
+
+
+# What the last sync of a repository was based on: the source revision and a fingerprint of the
+# config and projects.json, as a change to those may affect files that did not change themselves
+@dataclass
+class SyncState:
+    revision: str
+    fingerprint: str
+
+
+class SyncStateLoader:
+    SUFFIX = ".sync.json"
+
+    @classmethod
+    def load(cls, fspath, repo, fs):
+        try:
+            content = json.loads(fs.read_string(index_file(fspath, repo, cls.SUFFIX)))
+        except (FileNotFoundError, ValueError):
+            return None
+        return SyncState(content["revision"], content["fingerprint"])
+
+    @classmethod
+    def save(cls, state, fspath, repo, fs):
+        fs.write_string(
+            index_file(fspath, repo, cls.SUFFIX),
+            json.dumps({"revision": state.revision, "fingerprint": state.fingerprint}),
+        )
+
+
+def fingerprint(fs, *files):
+    return hashb("\0".join(fs.read_string(file) for file in files).encode())
+
+
+# Decides which source files have to be looked at by an incremental sync: the changed ones and,
+# given the DependencyGraph of the previous sync, the outputs built from them. Returns None, after
+# explaining why on stderr, whenever the whole repository must be scanned instead. An explicit
+# revision still requires the fingerprint of the previous sync, if there is one, to match.
+def incremental_changes(git, from_path, state, current_fingerprint, since=None, dependencies=None):
+    if since is None and state is None:
+        return _full_scan("there is no record of a previous sync")
+    if state is not None and state.fingerprint != current_fingerprint:
+        return _full_scan("the config or projects.json changed since the previous sync")
+    if since is None:
+        since = state.revision
+    changes = git.changes_since(from_path, since)
+    if changes is None:
+        return _full_scan(f"changes since revision {since} are not known")
+    touched = changes.changed | changes.deleted
+    if dependencies is not None:
+        dependents = dependencies.dependents(touched) - touched
+        changes.changed |= dependents
+    elif any(file.endswith(DEPENDENCY_SUFFIXES) for file in touched):
+        return _full_scan("files that other files may depend on changed")
+    else:
+        dependents = set()
+    print(
+        f"Incremental sync since {since}: {len(changes.changed) - len(dependents)} changed, "
+        f"{len(changes.deleted)} deleted files, {len(dependents)} dependent files",
+        file=sys.stderr,
+    )
+    return changes
+
+
+def _full_scan(reason):
+    print(f"Incremental sync not possible, {reason}, scanning all files", file=sys.stderr)
+    return None
@@ -1,36 +1,73 @@
 import json
+import re
+import sys
 from contextlib import contextmanager
 from dataclasses import dataclass
-from hashlib import sha256
 from os import path
+from urllib.parse import quote
 
 
+# Items are kept in a dict keyed by the indexed file, with a secondary dict per repository, so that
+# adding, removing and listing a repository's items doesn't require scanning the whole index
 class FileIndex:
-    def __init__(self, items: tuple):
-        self.items = items
-        self.removed = ()
+    def __init__(self, items: tuple, legacy_files: dict = None):
+        self._items = {}
+        self._by_repo = {}
+        self._added = []
+        self._removed = []
+        for item in items:
+            self._insert(item)
+        # Files in the old, one file per item layout, to be removed when the index is saved, with
+        # the repository of their item
+        self.legacy_files = legacy_files or {}
+
+    @property
+    def items(self):
+        return tuple(self._items.values())
+
+    @property
+    def added(self):
+        return tuple(self._added)
+
+    @property
+    def removed(self):
+        return tuple(self._removed)
+
+    # Repositories whose items were added or removed since the index was loaded
+    def changed_repos(self):
+        return {item.repo for item in self._added + self._removed} | set(self.legacy_files.values())
+
+    def items_for(self, repo):
+        return tuple(self._by_repo.get(repo, {}).values())
 
     def add(self, item):
-        for existing_item in self.items:
-            # If it's not the same file, keep looking
-            if item.file != existing_item.file:
-                continue
-            # If it's the same file coming from the same repo, do nothing, just return
-            if item.repo == existing_item.repo:
-                return
-            # If it's the same file coming from a different repo, raise an error
-            raise FileIndexError(
-                f"The file {item.file} is already indexed from repository {existing_item.repo}"
-            )
-        # If the loop ends, it means the file is not indexed yet, so add it
-        self.items = self.items + (item,)
+        existing_item = self._items.get(item.file)
+        # If it's not indexed yet, add it
+        if existing_item is None:
+            self._insert(item)
+            self._added.append(item)
+            return
+        # If it's the same file coming from the same repo, do nothing, just return
+        if item.repo == existing_item.repo:
+            return
+        # If it's the same file coming from a different repo, raise an error
+        raise FileIndexError(
+            f"The file {item.file} is already indexed from repository {existing_item.repo}"
+        )
 
     def remove(self, item):
-        removed = tuple(filter(lambda existing_item: existing_item.file == item.file, self.items))
-        self.items = tuple(
-            filter(lambda existing_item: existing_item.file != item.file, self.items)
-        )
-        self.removed = self.removed + removed
+        removed = self._items.pop(item.file, None)
+        if removed is None:
+            return
+        del self._by_repo[removed.repo][removed.file]
+        self._removed.append(removed)
+
+    def _insert(self, item):
+        replaced = self._items.get(item.file)
+        if replaced is not None:
+            del self._by_repo[replaced.repo][replaced.file]
+        self._items[item.file] = item
+        self._by_repo.setdefault(item.repo, {})[item.file] = item
 
 
 @dataclass
@@ -39,24 +76,54 @@ class FileIndexItem:
     repo: str
 
 
+# The index is stored as one JSON Lines file per repository (see index_file), one item per line,
+# sorted by file. Only the files of repositories with added or removed items are rewritten. Indexes
+# in the old layout, one JSON file per item in `<repo>/<sha256 of the file>`, are migrated on save.
 class FileIndexLoader:
+    SUFFIX = ".jsonl"
+    LEGACY_FILE = re.compile(r"(.+/)?[0-9a-f]{64}")
+
     @classmethod
     def load(cls, fspath, fs):
         items = []
-        for file in fs.scan(fspath, ".*"):
-            cnt = json.loads(fs.read_string(path.join(fspath, file)))
-            items.append(FileIndexItem(cnt["file"], cnt["repo"]))
-        return FileIndex(tuple(items))
+        legacy_files = {}
+        for file in sorted(fs.scan(fspath, ".*")):
+            if cls.LEGACY_FILE.fullmatch(file):
+                cnt = json.loads(fs.read_string(path.join(fspath, file)))
+                items.append(FileIndexItem(cnt["file"], cnt["repo"]))
+                legacy_files[file] = cnt["repo"]
+            elif "/" not in file and file.endswith(cls.SUFFIX):
+                for line in fs.read_string(path.join(fspath, file)).splitlines():
+                    cnt = json.loads(line)
+                    items.append(FileIndexItem(cnt["file"], cnt["repo"]))
+        return FileIndex(tuple(items), legacy_files)
 
     @classmethod
     def save(cls, index, fspath, fs):
-        for item in index.items:
-            fs.write_string(
-                path.join(fspath, item.repo, hash(item.file)),
-                json.dumps({"file": item.file, "repo": item.repo}),
-            )
-        for removed in index.removed:
-            fs.delete(path.join(fspath, removed.repo, hash(removed.file)))
+        changed_repos = index.changed_repos()
+        for repo in sorted(changed_repos):
+            content = cls.serialize(index.items_for(repo))
+            repo_file = index_file(fspath, repo, cls.SUFFIX)
+            if content:
+                fs.write_string(repo_file, content)
+            elif fs.is_file(repo_file):
+                fs.delete(repo_file)
+        for legacy_file in index.legacy_files:
+            fs.delete(path.join(fspath, legacy_file))
+        untouched = [item for item in index.items if item.repo not in changed_repos]
+        print(
+            f"Index: {len(index.added)} added, {len(index.removed)} removed, "
+            f"{len(changed_repos)} repository files updated, "
+            f"{len(untouched)} unchanged entries not rewritten",
+            file=sys.stderr,
+        )
+
+    @classmethod
+    def serialize(cls, items):
+        return "".join(
+            json.dumps({"file": item.file, "repo": item.repo}) + "\n"
+            for item in sorted(items, key=lambda item: item.file)
+        )
 
     @classmethod
     @contextmanager
@@ -71,5 +138,7 @@ class FileIndexError(Exception):
     pass
 
 
-def hash(some_str):
-    return sha256(some_str.encode()).hexdigest()
+# Path of a file with the given suffix that belongs to a repository, in the index directory. The
+# repository name is usually `<owner>/<repo>`, so it's encoded to keep the files in one directory.
+def index_file(fspath, repo, suffix):
+    return path.join(fspath, quote(repo, safe="") + suffix)
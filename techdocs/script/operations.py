@@ -1,9 +1,13 @@
 import json
 import os
+import re
+import shlex
 import shutil
 import subprocess
 import tempfile
+from functools import lru_cache
 
+from comparison import TieredComparator
 from frontmatter import (
     FrontmatterEnricher,
     custom_edit_url,
@@ -11,13 +15,17 @@ from frontmatter import (
     last_update,
     source_frontmatter_hash,
 )
-from hash import hashb
+from hash import decode_text, hashb, hashb_text
 
 
 class GenericFileCopyOperation:
-    def __init__(self, source_abs, destination_abs):
+    def __init__(self, source_abs, destination_abs, source_stat=None, comparator=None):
         self.source_abs = source_abs
         self.destination_abs = destination_abs
+        # Stat info collected while scanning the source tree, if any, so it doesn't have to be
+        # fetched again
+        self.source_stat = source_stat
+        self.comparator = comparator or TieredComparator()
 
     def name(self):
         return "copy"
@@ -26,11 +34,9 @@ class GenericFileCopyOperation:
         fs.copy(self.source_abs, self.destination_abs)
 
     def has_changes(self, fs):
-        if (not fs.is_file(self.destination_abs)) or hashb(fs.read_bytes(self.source_abs)) != hashb(
-                fs.read_bytes(self.destination_abs)
-        ):
-            return True
-        return False
+        return self.comparator.has_changes(
+            fs, self.source_abs, self.destination_abs, self.source_stat
+        )
 
     def source_files(self):
         return [self.source_abs]
@@ -41,6 +47,9 @@ class GenericFileCopyOperation:
     def mkd(self, path_formatter):
         return f"* [COPY] {path_formatter.format(self.source_abs)} -> {path_formatter.format(self.destination_abs)}"
 
+    def to_plan(self):
+        return {"type": "copy", "source": self.source_abs, "destination": self.destination_abs}
+
 
 class YAMLPrefaceEnrichingCopyOperation:
     def __init__(self, source_abs, destination_abs, from_abs, author, branch):
@@ -68,18 +77,20 @@ class YAMLPrefaceEnrichingCopyOperation:
         fs.write_string(self.destination_abs, new_content)
 
     def has_changes(self, fs):
-        dest_file = fs.read_string(self.destination_abs) if fs.is_file(self.destination_abs) else ""
-        source_file = fs.read_string(self.source_abs)
+        if not fs.is_file(self.destination_abs):
+            return True
+        source = fs.digest(self.source_abs, "markdown-source", source_fingerprint)
+        destination = fs.digest(
+            self.destination_abs, "markdown-destination", destination_fingerprint
+        )
 
         if any(
-                [
-                    not fs.is_file(self.destination_abs),
-                    file_has_no_frontmatter(fs, dest_file),
-                    files_content_ignoring_frontmatter_is_different(fs, source_file, dest_file),
-                    source_frontmatter_hash_is_different_than_one_cached_in_destination(
-                        fs, source_file, dest_file
-                    ),
-                ]
+            [
+                not destination["enriched"],
+                source["content"] != destination["content"],
+                # the source frontmatter hash is not cached in destination or is outdated
+                source["frontmatter"] != "" and source["frontmatter"] != destination["frontmatter"],
+            ]
         ):
             return True
         return False
@@ -93,23 +104,36 @@ class YAMLPrefaceEnrichingCopyOperation:
     def mkd(self, path_formatter):
         return f"* [COPY] {path_formatter.format(self.source_abs)} -> {path_formatter.format(self.destination_abs)}"
 
-
-def file_has_no_frontmatter(fs, file):
-    return "x_tech_docs_enriched: true" not in file
-
-
-def files_content_ignoring_frontmatter_is_different(fs, first_file, second_file):
-    return hashb(FrontmatterEnricher(first_file).strip().encode()) != hashb(
-        FrontmatterEnricher(second_file).strip().encode()
-    )
-
-
-def source_frontmatter_hash_is_different_than_one_cached_in_destination(
-        fs, source_file, destination_file
-):
-    return source_file.startswith("---") and hashb(
-        source_file.split("---\n")[1].encode()
-    ) != get_source_frontmatter_hash(destination_file)
+    def to_plan(self):
+        return {
+            "type": "markdown",
+            "source": self.source_abs,
+            "destination": self.destination_abs,
+            "from": self.from_abs,
+            "author": self.author,
+            "branch": self.branch,
+        }
+
+
+# Summary of a markdown source file, enough to tell whether its enriched copy is up to date
+def source_fingerprint(content):
+    source_file = decode_text(content)
+    return {
+        "content": hashb(FrontmatterEnricher(source_file).strip().encode()),
+        "frontmatter": (
+            hashb(source_file.split("---\n")[1].encode()) if source_file.startswith("---") else ""
+        ),
+    }
+
+
+# Summary of an enriched markdown file in the destination, see source_fingerprint
+def destination_fingerprint(content):
+    destination_file = decode_text(content)
+    return {
+        "content": hashb(FrontmatterEnricher(destination_file).strip().encode()),
+        "enriched": "x_tech_docs_enriched: true" in destination_file,
+        "frontmatter": get_source_frontmatter_hash(destination_file),
+    }
 
 
 class DeleteOperation:
@@ -134,12 +158,17 @@ class DeleteOperation:
     def mkd(self, path_formatter):
         return f"* [DELETE] {path_formatter.format(self.destination_abs)}"
 
+    def to_plan(self):
+        return {"type": "delete", "destination": self.destination_abs}
+
 
 class PlantUMLDiagramRenderOperation:
-    def __init__(self, source_puml_abs, destination_svg_abs, generator):
+    def __init__(self, source_puml_abs, destination_svg_abs, generator, resolver=None):
         self.source_puml_abs = source_puml_abs
         self.destination_svg_abs = destination_svg_abs
         self.generator = generator
+        # Usually shared by all the diagrams, so that common includes are read once
+        self.resolver = resolver or PlantUMLIncludeResolver()
 
     def name(self):
         return "plantuml"
@@ -164,7 +193,7 @@ class PlantUMLDiagramRenderOperation:
         return self.header(fs) not in fs.read_string(self.destination_svg_abs)
 
     def header(self, fs):
-        return header(hashb(get_full_puml_content(fs, self.source_puml_abs)))
+        return header(hashb(self.resolver.content(fs, self.source_puml_abs)))
 
     def mkd(self, path_formatter):
         return (
@@ -172,56 +201,241 @@ class PlantUMLDiagramRenderOperation:
             f"{path_formatter.format(self.destination_svg_abs)}"
         )
 
+    def to_plan(self):
+        return {
+            "type": "plantuml",
+            "source": self.source_puml_abs,
+            "destination": self.destination_svg_abs,
+        }
+
 
 def header(hash):
     return "<!-- @tech-docs-hash=" + hash + " -->"
 
 
 def get_full_puml_content(fs, the_path):
-    content = fs.read_bytes(the_path)
-    lines = content.split(b"\n")
-    for i, line in enumerate(lines):
-        if line.startswith(b"!include ") and b"http://" not in line and b"https://" not in line:
-            try:
-                lines[i] = get_full_puml_content(
-                    fs,
-                    os.path.join(os.path.dirname(the_path), line.split(b"!include ")[1].decode()),
-                )
-            except (
-                    FileNotFoundError
-            ):  # Let PlantUML handle the error, also we don't need to hack 10 ifs with various import syntaxes here
-                pass
-    return b"\n".join(lines)
+    return PlantUMLIncludeResolver().content(fs, the_path)
+
+
+class PlantUMLIncludeError(Exception):
+    pass
+
+
+# Inlines local !include files into PlantUML diagrams. Every file is read and expanded once per
+# resolver, so a resolver shared by all the diagrams of a run reads a common include only once.
+# Includes that don't exist are left as they are, PlantUML will report them.
+class PlantUMLIncludeResolver:
+    def __init__(self):
+        self._expanded = {}  # file -> its content with includes inlined, None if it doesn't exist
+        self._includes = {}  # file -> files it includes directly
+
+    def content(self, fs, file):
+        file = os.path.normpath(file)
+        if file not in self._expanded:
+            self._resolve(fs, file)
+        if self._expanded[file] is None:
+            raise FileNotFoundError(f"File {file} not found")
+        return self._expanded[file]
+
+    # Files included by `file`, directly or through other includes, including missing ones
+    def includes(self, fs, file):
+        file = os.path.normpath(file)
+        self.content(fs, file)
+        result, pending = set(), [file]
+        while pending:
+            for included in self._includes.get(pending.pop(), ()):
+                if included not in result:
+                    result.add(included)
+                    pending.append(included)
+        return result
+
+    # Files whose content depends on `file`, directly or through other includes, among the files
+    # resolved so far
+    def dependents(self, file):
+        file = os.path.normpath(file)
+        result, pending = set(), [file]
+        while pending:
+            current = pending.pop()
+            for includer, included in list(self._includes.items()):
+                if current in included and includer not in result:
+                    result.add(includer)
+                    pending.append(includer)
+        return result
+
+    # Depth first, with an explicit stack, so that deep include chains don't hit the recursion
+    # limit and cycles can be reported
+    def _resolve(self, fs, file):
+        parsed = {}
+        stack = [file]
+        while stack:
+            current = stack[-1]
+            if current not in parsed:
+                try:
+                    parsed[current] = _parse_includes(fs, current)
+                except FileNotFoundError:
+                    if current == file:
+                        raise
+                    self._expanded[current] = None
+                    stack.pop()
+                    continue
+                self._includes[current] = {included for _, included in parsed[current][1]}
+            lines, includes = parsed[current]
+            pending = [included for _, included in includes if included not in self._expanded]
+            if pending:
+                if pending[0] in stack:
+                    cycle = stack[stack.index(pending[0]) :] + [pending[0]]
+                    raise PlantUMLIncludeError(f"Include cycle: {' -> '.join(cycle)}")
+                stack.append(pending[0])
+                continue
+            lines = list(lines)
+            for i, included in includes:
+                if self._expanded[included] is not None:
+                    lines[i] = self._expanded[included]
+            self._expanded[current] = b"\n".join(lines)
+            stack.pop()
+
+
+# Returns the lines of a PlantUML file and the (line number, file) pairs of its local includes
+def _parse_includes(fs, file):
+    lines = fs.read_bytes(file).split(b"\n")
+    directory = os.path.dirname(file)
+    includes = [
+        (i, os.path.normpath(os.path.join(directory, line.split(b"!include ")[1].decode())))
+        for i, line in enumerate(lines)
+        if line.startswith(b"!include ") and b"http://" not in line and b"https://" not in line
+    ]
+    return lines, includes
 
 
 class DockerPlantUMLGenerator:
+    IMAGE = "ghcr.io/plantuml/plantuml:1"
+
+    def __init__(self, runner=subprocess.run):
+        self.runner = runner
+        # Diagrams rendered by prefetch, by source path, waiting for generate
+        self._prefetched = {}
+
+    # Identifies the renderer, rendered diagrams are cached per version
+    @property
+    def version(self):
+        return image_digest(self.runner, self.IMAGE)
+
+    @property
+    def image(self):
+        return pinned_image(self.runner, self.IMAGE)
+
     def generate(self, fs, source_puml_abs):
+        svg = self._prefetched.pop(source_puml_abs, None)
+        if svg is not None:
+            return svg
+        outputs = self._render([source_puml_abs])
+        if len(outputs) != 1:
+            raise Exception("PlantUML generation failed")
+        return next(iter(outputs.values()))
+
+    # Renders the diagrams in as few container runs as possible (one, unless files in different
+    # directories share a name), so that the JVM is started once rather than once per diagram.
+    # Outputs are told apart by the source's name, so diagrams that name their output (after
+    # @startuml) are left to generate, which renders them one by one, as are diagrams with several
+    # pages.
+    def prefetch(self, fs, sources):
+        batches = []
+        for source in sources:
+            if names_output(fs, source):
+                continue
+            stem = os.path.splitext(os.path.basename(source))[0]
+            batch = next((batch for batch in batches if stem not in batch), None)
+            if batch is None:
+                batch = {}
+                batches.append(batch)
+            batch[stem] = source
+        for batch in batches:
+            outputs = self._render(list(batch.values()))
+            for stem, source in batch.items():
+                if f"{stem}.svg" in outputs and f"{stem}_001.svg" not in outputs:
+                    self._prefetched[source] = outputs[f"{stem}.svg"]
+
+    # Returns the content of the files PlantUML generated, by name
+    def _render(self, sources):
+        root = os.path.commonpath([os.path.dirname(source) for source in sources])
+        dirpath = tempfile.mkdtemp()
         try:
-            dirpath = tempfile.mkdtemp()
-            subprocess.run(
+            self.runner(
                 [
                     "docker",
                     "run",
                     "-v",
-                    f"{os.path.dirname(source_puml_abs)}:/src",
+                    f"{root}:/src",
                     "-v",
                     f"{dirpath}:/out",
-                    "ghcr.io/plantuml/plantuml:1",
-                    f"/src/{os.path.basename(source_puml_abs)}",
+                    self.image,
+                    *[f"/src/{os.path.relpath(source, root)}" for source in sources],
                     "-o",
                     "/out",
                     "-tsvg",
                 ]
             )
-            generated_files = fs.scan(dirpath, ".*")
-            if len(generated_files) != 1:
-                raise Exception("PlantUML generation failed")
-            with open(os.path.join(dirpath, generated_files[0]), "r") as f:
-                return f.read()
+            outputs = {}
+            for name in os.listdir(dirpath):
+                with open(os.path.join(dirpath, name), "r") as f:
+                    outputs[name] = f.read()
+            return outputs
         finally:
             shutil.rmtree(dirpath)
 
 
+NAMED_DIAGRAM = re.compile(r"^\s*@start\w+[ \t]+\S", re.MULTILINE)
+
+
+# Whether the diagram's output is named after something else than its source file
+def names_output(fs, source_puml_abs):
+    try:
+        return NAMED_DIAGRAM.search(fs.read_string(source_puml_abs)) is not None
+    except FileNotFoundError:
+        return True
+
+
+# Looks rendered diagrams up in a cache (see cache.py) before rendering them with `generator`. The
+# key covers the diagram with its includes inlined and the renderer version, so it stays valid
+# across branches, renames and fresh checkouts.
+class CachingPlantUMLGenerator:
+    def __init__(self, generator, cache, resolver=None):
+        self.generator = generator
+        self.cache = cache
+        self.resolver = resolver or PlantUMLIncludeResolver()
+        # Diagrams found in the cache by prefetch, by key, waiting for generate
+        self._hits = {}
+
+    @property
+    def version(self):
+        return self.generator.version
+
+    def generate(self, fs, source_puml_abs):
+        key = self.key(fs, source_puml_abs)
+        svg = self._hits.pop(key, None) or self.cache.get(key)
+        if svg is None:
+            svg = self.generator.generate(fs, source_puml_abs)
+            self.cache.put(key, svg)
+        return svg
+
+    # Looks all the diagrams up at once, only the ones missing from the cache are prefetched by
+    # the wrapped generator
+    def prefetch(self, fs, sources):
+        misses = []
+        for source in sources:
+            key = self.key(fs, source)
+            svg = self.cache.get(key)
+            if svg is None:
+                misses.append(source)
+            else:
+                self._hits[key] = svg
+        if misses and hasattr(self.generator, "prefetch"):
+            self.generator.prefetch(fs, misses)
+
+    def key(self, fs, source_puml_abs):
+        return hashb(self.version.encode() + b"\0" + self.resolver.content(fs, source_puml_abs))
+
+
 class OpenAPIOperation:
     def __init__(
             self,
@@ -230,37 +444,55 @@ class OpenAPIOperation:
             ref_files,
             bundler,
             validator,
-            previous_operations,
     ):
         self.source_abs = source_abs
         self.destination_abs = destination_abs
         self.ref_files = ref_files
         self.bundler = bundler
         self.validator = validator
-        self.previous_operations = previous_operations
 
     def name(self):
         return "openapi"
 
     def execute(self, fs):
-        self.validator.validate(self.source_abs, self.ref_files)
-        checksum = hashb(fs.read_string(self.source_abs).encode())
+        self.validator.validate(fs, self.source_abs, self.ref_files)
+        checksum = fs.digest(self.source_abs, "sha256-text", hashb_text)
         bundled_content = json.loads(self.bundler.bundle(fs, self.source_abs, self.ref_files, self.destination_abs))
+        # Last in the file, so that they can be read without parsing the whole bundle
+        bundled_content.pop("x-api-checksum", None)
+        bundled_content.pop("x-api-ref-checksums", None)
         bundled_content["x-api-checksum"] = checksum
+        bundled_content["x-api-ref-checksums"] = self.ref_checksums(fs)
 
         fs.write_string(self.destination_abs, json.dumps(bundled_content, indent=2))
 
+    # Compares the checksums of the source and of every referenced file with the ones stored in
+    # the bundled destination when it was generated
     def has_changes(self, fs):
-        for ref_file in self.ref_files:
-            for operation in self.previous_operations:
-                if not isinstance(operation, GenericFileCopyOperation):
-                    continue
-                if ref_file in operation.source_files():
-                    if operation.has_changes(fs):
-                        return True
         if not fs.is_file(self.destination_abs):
             return True
-        return not self.valid_checksum(fs, self.source_abs, self.destination_abs)
+        stored = fs.digest(
+            self.destination_abs,
+            "x-api-checksums-tail",
+            api_checksums_from_tail,
+            tail=API_CHECKSUMS_TAIL_BYTES,
+        )
+        if stored is None:
+            stored = fs.digest(self.destination_abs, "x-api-checksums", api_checksums)
+        if stored["x-api-checksum"] != fs.digest(self.source_abs, "sha256-text", hashb_text):
+            return True
+        # Destinations generated before the ref checksums were stored are only up to date if the
+        # spec has no references
+        return stored.get("x-api-ref-checksums", {}) != self.ref_checksums(fs)
+
+    # sha256 of every referenced file, by its path relative to the spec
+    def ref_checksums(self, fs):
+        return {
+            os.path.relpath(ref_file, os.path.dirname(self.source_abs)): (
+                fs.digest(ref_file) if fs.is_file(ref_file) else None
+            )
+            for ref_file in sorted(self.ref_files)
+        }
 
     def source_files(self):
         return [self.source_abs]
@@ -271,19 +503,134 @@ class OpenAPIOperation:
     def mkd(self, path_formatter):
         return f"* [OPENAPI] {path_formatter.format(self.source_abs)} -> {path_formatter.format(self.destination_abs)}"
 
-    def valid_checksum(self, fs, source_abs, destination_abs):
-        source_checksum = hashb(fs.read_string(source_abs).encode())
-        destination_checksum = json.loads(fs.read_string(destination_abs))["x-api-checksum"]
-        return source_checksum == destination_checksum
+    def to_plan(self):
+        return {
+            "type": "openapi",
+            "source": self.source_abs,
+            "destination": self.destination_abs,
+            "ref_files": sorted(self.ref_files),
+        }
+
+
+# How much of the end of a bundled spec is read to find the checksums stored in it
+API_CHECKSUMS_TAIL_BYTES = 64 * 1024
+
+
+# Returns the checksums stored at the end of a bundled spec (see OpenAPIOperation.execute) from
+# the end of the file, None if they are not there
+def api_checksums_from_tail(content):
+    start = content.rfind(b'"x-api-checksum":')
+    if start == -1:
+        return None
+    try:
+        stored = json.loads(b"{" + content[start:])
+    except ValueError:
+        return None
+    return stored if isinstance(stored, dict) else None
+
+
+def api_checksums(content):
+    bundled_content = json.loads(content)
+    return {
+        key: bundled_content[key]
+        for key in ("x-api-checksum", "x-api-ref-checksums")
+        if key in bundled_content
+    }
+
+
+# Key of a spec's outputs in a cache: covers the spec, every file it references, where they are
+# relative to each other, and the tool producing the output
+def openapi_key(fs, tool, source_abs, ref_files):
+    files = sorted({source_abs, *ref_files})
+    base_path = os.path.commonpath([os.path.dirname(file) for file in files])
+    return hashb(
+        "\n".join(
+            [tool, os.path.relpath(source_abs, base_path)]
+            + [f"{os.path.relpath(file, base_path)} {fs.digest(file)}" for file in files]
+        ).encode()
+    )
+
+
+# Looks bundled specs up in a cache (see cache.py) before bundling them with `bundler`
+class CachingOpenAPIBundler:
+    def __init__(self, bundler, cache):
+        self.bundler = bundler
+        self.cache = cache
+        # Specs found in the cache by prefetch, by key, waiting for bundle
+        self._hits = {}
+
+    def bundle(self, fs, source_abs, ref_files, destination_abs):
+        key = openapi_key(fs, self.bundler.version, source_abs, ref_files)
+        bundled = self._hits.pop(key, None) or self.cache.get(key)
+        if bundled is None:
+            bundled = self.bundler.bundle(fs, source_abs, ref_files, destination_abs)
+            self.cache.put(key, bundled)
+        return bundled
+
+    # Only the specs missing from the cache are prefetched by the wrapped bundler
+    def prefetch(self, fs, specs):
+        misses = []
+        for spec in specs:
+            key = openapi_key(fs, self.bundler.version, spec[0], spec[1])
+            bundled = self.cache.get(key)
+            if bundled is None:
+                misses.append(spec)
+            else:
+                self._hits[key] = bundled
+        if misses and hasattr(self.bundler, "prefetch"):
+            self.bundler.prefetch(fs, misses)
+
+
+# Remembers, in a cache, which specs (with their references) passed validation, so that they are
+# not validated again
+class CachingOpenAPIValidator:
+    def __init__(self, validator, cache):
+        self.validator = validator
+        self.cache = cache
+
+    def validate(self, fs, source_abs, ref_files):
+        key = openapi_key(fs, self.validator.version, source_abs, ref_files)
+        if self.cache.get(key) is None:
+            self.validator.validate(fs, source_abs, ref_files)
+            self.cache.put(key, "valid")
+
+    # Only the specs missing from the cache are prefetched by the wrapped validator
+    def prefetch(self, fs, specs):
+        misses = [
+            spec
+            for spec in specs
+            if self.cache.get(openapi_key(fs, self.validator.version, spec[0], spec[1])) is None
+        ]
+        if misses and hasattr(self.validator, "prefetch"):
+            self.validator.prefetch(fs, misses)
 
 
 class OpenAPIBundler:
+    IMAGE = "redocly/cli"
+
+    def __init__(self, runner=subprocess.run):
+        self.runner = runner
+        # Specs bundled by prefetch, by (source, destination), waiting for bundle
+        self._prefetched = {}
+
+    # Identifies the bundler, bundled specs are cached per version
+    @property
+    def version(self):
+        return image_digest(self.runner, self.IMAGE)
+
+    @property
+    def image(self):
+        return pinned_image(self.runner, self.IMAGE)
+
     def bundle(self, fs, source_abs, ref_files: list[str], destination_abs):
+        bundled = self._prefetched.pop((source_abs, destination_abs), None)
+        if bundled is not None:
+            return bundled
         try:
             ref_files_volumes = {os.path.dirname(ref_file) for ref_file in ref_files} | {os.path.dirname(source_abs)}
             base_path = os.path.commonpath(ref_files_volumes)
             dir_path = tempfile.mkdtemp()
-            output = subprocess.run(
+            output = self.runner(
                 [
                     "docker",
                     "run",
@@ -291,14 +638,10 @@ class OpenAPIBundler:
                     f"{base_path}:/spec",
                     "-v",
                     f"{dir_path}:/out",
-                    "redocly/cli",
-                    "bundle",
-                    "--dereferenced",
-                    f"/spec/{os.path.relpath(source_abs, base_path)}",
-                    "--output",
-                    f"/out/{os.path.basename(destination_abs)}",
-                    "--ext",
-                    "json",
+                    self.image,
+                    *self._arguments(
+                        base_path, source_abs, f"/out/{os.path.basename(destination_abs)}"
+                    ),
                 ],
                 capture_output=True,
             )
@@ -312,11 +655,57 @@ class OpenAPIBundler:
         finally:
             shutil.rmtree(dir_path)
 
+    # Bundles the (source, ref files, destination) specs in one container run. Specs that fail are
+    # left to bundle, which reports the error.
+    def prefetch(self, fs, specs):
+        base_path = openapi_base_path(specs)
+        results = run_in_one_container(
+            self.runner,
+            self.image,
+            base_path,
+            [
+                self._arguments(base_path, source, f"/out/{i}.json")
+                for i, (source, _, _) in enumerate(specs)
+            ],
+        )
+        for (source, _, destination), (status, output) in zip(specs, results or []):
+            if status == 0 and output is not None:
+                self._prefetched[(source, destination)] = output
+
+    def _arguments(self, base_path, source_abs, output):
+        return [
+            "bundle",
+            "--dereferenced",
+            f"/spec/{os.path.relpath(source_abs, base_path)}",
+            "--output",
+            output,
+            "--ext",
+            "json",
+        ]
+
 
 class OpenAPIValidator:
     RDME_VERSION = "latest"
-
-    def validate(self, source_abs, ref_files: list[str]):
+    IMAGE = f"ghcr.io/readmeio/rdme:{RDME_VERSION}"
+
+    def __init__(self, runner=subprocess.run):
+        self.runner = runner
+        # Specs validated by prefetch, waiting for validate
+        self._validated = set()
+
+    # Identifies the validator, validation results are cached per version
+    @property
+    def version(self):
+        return image_digest(self.runner, self.IMAGE)
+
+    @property
+    def image(self):
+        return pinned_image(self.runner, self.IMAGE)
+
+    def validate(self, fs, source_abs, ref_files: list[str]):
+        if source_abs in self._validated:
+            self._validated.discard(source_abs)
+            return
         ref_files_volumes = {os.path.dirname(ref_file) for ref_file in ref_files} | {os.path.dirname(source_abs)}
         base_path = os.path.commonpath(ref_files_volumes)
         args = [
@@ -326,12 +715,148 @@ class OpenAPIValidator:
             f"{base_path}:/spec",
             "-w",
             "/spec",
-            f"ghcr.io/readmeio/rdme:{self.RDME_VERSION}",
+            self.image,
+            *self._arguments(base_path, source_abs),
+        ]
+        output = self.runner(args, capture_output=True)
+        if output.returncode != 0:
+            raise Exception(f"{output.stderr.decode()}"
+                            f"\nOpenAPI validation failed for '{source_abs}'")
+
+    # Validates the (source, ref files, destination) specs in one container run. Specs that fail
+    # are left to validate, which reports the error.
+    def prefetch(self, fs, specs):
+        base_path = openapi_base_path(specs)
+        results = run_in_one_container(
+            self.runner,
+            self.image,
+            base_path,
+            [self._arguments(base_path, source) for source, _, _ in specs],
+        )
+        for (source, _, _), (status, _) in zip(specs, results or []):
+            if status == 0:
+                self._validated.add(source)
+
+    def _arguments(self, base_path, source_abs):
+        return [
             "openapi:validate",
             f"/spec/{os.path.relpath(source_abs, base_path)}",
             f"--workingDirectory=/spec/{os.path.dirname(os.path.relpath(source_abs, base_path))}",
         ]
-        output = subprocess.run(args, capture_output=True)
+
+
+# Directory containing all the specs and the files they reference
+def openapi_base_path(specs):
+    return os.path.commonpath(
+        [os.path.dirname(file) for source, ref_files, _ in specs for file in [source, *ref_files]]
+    )
+
+
+# Runs the image's entrypoint once for every item of `commands` (lists of arguments), in a single
+# container, so that the container is started once. `base_path` is mounted at /spec, which is also
+# the working directory, and every command gets its own /out/<i>.json. Returns the exit status and
+# the /out/<i>.json content (or None) of every command, or None when the image's entrypoint can't
+# be determined.
+def run_in_one_container(runner, image, base_path, commands):
+    entrypoint = image_entrypoint(runner, image)
+    if entrypoint is None:
+        return None
+    script = "".join(
+        f"{shlex.join(entrypoint + command)} </dev/null >/out/{i}.log 2>&1; "
+        f"echo $? >/out/{i}.status\n"
+        for i, command in enumerate(commands)
+    )
+    dir_path = tempfile.mkdtemp()
+    try:
+        runner(
+            [
+                "docker",
+                "run",
+                "-v",
+                f"{base_path}:/spec",
+                "-v",
+                f"{dir_path}:/out",
+                "-w",
+                "/spec",
+                "--entrypoint",
+                "sh",
+                image,
+                "-c",
+                script,
+            ],
+            capture_output=True,
+        )
+        results = []
+        for i in range(len(commands)):
+            status = _read(os.path.join(dir_path, f"{i}.status"))
+            results.append(
+                (
+                    int(status) if status is not None and status.strip().isdigit() else None,
+                    _read(os.path.join(dir_path, f"{i}.json")),
+                )
+            )
+        return results
+    finally:
+        shutil.rmtree(dir_path)
+
+
+def image_entrypoint(runner, image):
+    entrypoint = inspect_image(runner, image, "{{json .Config.Entrypoint}}")
+    if entrypoint is None:
+        return None
+    return json.loads(entrypoint) or []
+
+
+# The digest the tag currently points to in the registry, looked up without pulling the image, or
+# the digest of the local image when the registry can't be reached. Cached outputs are keyed by it
+# rather than by the tag, so that they are not reused when the tag moves to a new image, and the
+# image is only pulled when an output that is not cached has to be rendered.
+def image_digest(runner, image):
+    digest = _lookup_digest(runner, image)
+    if digest is None:
+        raise Exception(f"Could not determine the digest of the `{image}` image")
+    return digest
+
+
+@lru_cache(maxsize=None)
+def _lookup_digest(runner, image):
+    output = runner(
+        ["docker", "buildx", "imagetools", "inspect", "--format", "{{.Manifest.Digest}}", image],
+        capture_output=True,
+    )
+    if output.returncode == 0 and output.stdout.strip():
+        return output.stdout.decode().strip()
+    output = runner(
+        ["docker", "image", "inspect", "--format", "{{index .RepoDigests 0}}", image],
+        capture_output=True,
+    )
+    if output.returncode == 0 and b"@" in output.stdout:
+        return output.stdout.decode().strip().split("@", 1)[1]
+    return None
+
+
+# `image` pinned to its digest, so that containers run the image outputs are keyed by (pulling it
+# if needed), or `image` itself if the digest is not known
+def pinned_image(runner, image):
+    digest = _lookup_digest(runner, image)
+    return f"{image}@{digest}" if digest is not None else image
+
+
+# Returns the `template` formatted by docker image inspect, or None if the image is not available
+def inspect_image(runner, image, template):
+    inspect = ["docker", "image", "inspect", "--format", template, image]
+    output = runner(inspect, capture_output=True)
+    if output.returncode != 0:
+        runner(["docker", "pull", image], capture_output=True)
+        output = runner(inspect, capture_output=True)
         if output.returncode != 0:
-            raise Exception(f"{output.stderr.decode()}"
-                            f"\nOpenAPI validation failed for '{source_abs}'")
+            return None
+    return output.stdout.decode()
+
+
+def _read(file):
+    try:
+        with open(file, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
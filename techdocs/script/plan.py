@@ -0,0 +1,232 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from copier import RelativeFormatter
+from dependencies import DependencyGraph, serialize as serialize_dependencies
+from incremental import SyncState
+from operations import (
+    DeleteOperation,
+    DockerPlantUMLGenerator,
+    GenericFileCopyOperation,
+    OpenAPIBundler,
+    OpenAPIOperation,
+    OpenAPIValidator,
+    PlantUMLDiagramRenderOperation,
+    PlantUMLIncludeResolver,
+    YAMLPrefaceEnrichingCopyOperation,
+)
+
+
+class PlanError(Exception):
+    pass
+
+
+# The outcome of the detection phase: what has to be done to synchronize a repository, so that it
+# can be executed later without detecting the changes again
+@dataclass
+class Plan:
+    repo: str
+    from_path: str
+    to_path: str
+    operations: list
+    index_added: List[str] = field(default_factory=list)
+    index_removed: List[str] = field(default_factory=list)
+    sync_state: Optional[SyncState] = None
+    dependencies: Optional[DependencyGraph] = None
+    # Size, mtime and sha256 of the source files when the plan was made, filled in when it's loaded
+    sources: Dict[str, tuple] = field(default_factory=dict)
+    # The markdown line of every operation, as printed by plan, filled in when it's loaded
+    listing: List[str] = field(default_factory=list)
+
+    @property
+    def count(self):
+        return len(self.operations)
+
+    # Source files that changed since the plan was made. Files with the same size and mtime are
+    # not read, the others are hashed only if their size is the same.
+    def stale_files(self, fs):
+        stale = []
+        for file, (size, mtime_ns, sha256) in self.sources.items():
+            if not fs.is_file(file):
+                if size is not None:
+                    stale.append(file)
+                continue
+            stat = fs.stat(file)
+            if stat.size != size or (stat.mtime_ns != mtime_ns and fs.digest(file) != sha256):
+                stale.append(file)
+        return stale
+
+
+# A plan file is JSON Lines, one object per line with sorted keys. Every repository has a section
+# of its own: a header, one line per operation (with its markdown line, so that the changes can be
+# shown without detecting them again), one line per index change and a summary, so that
+# sections can be written as they are produced and plans of several repositories merged by
+# concatenating them.
+class PlanLoader:
+    VERSION = 4
+
+    @classmethod
+    def save(cls, plans, fspath, fs):
+        fs.write_string(
+            fspath,
+            "".join(serialize(entry) for plan in plans for entry in cls.entries(plan, fs)),
+        )
+
+    @classmethod
+    def entries(cls, plan, fs):
+        yield {
+            "kind": "header",
+            "version": cls.VERSION,
+            "repo": plan.repo,
+            "from": plan.from_path,
+            "to": plan.to_path,
+            "sync_state": (
+                {"revision": plan.sync_state.revision, "fingerprint": plan.sync_state.fingerprint}
+                if plan.sync_state is not None
+                else None
+            ),
+            "dependencies": (
+                serialize_dependencies(plan.dependencies) if plan.dependencies is not None else None
+            ),
+        }
+        formatter = RelativeFormatter(plan.to_path, plan.from_path)
+        for operation in plan.operations:
+            entry = {
+                "kind": "operation",
+                **operation.to_plan(),
+                "listing": operation.mkd(formatter),
+            }
+            for key in ("source", "destination"):
+                if key in entry:
+                    size, mtime_ns, sha256 = file_details(fs, entry[key])
+                    entry.update(
+                        {key + "_size": size, key + "_mtime_ns": mtime_ns, key + "_sha256": sha256}
+                    )
+            yield entry
+        for file in plan.index_added:
+            yield {"kind": "index", "change": "add", "file": file}
+        for file in plan.index_removed:
+            yield {"kind": "index", "change": "remove", "file": file}
+        yield {"kind": "summary", "count": plan.count}
+
+    # Returns the entries of every section of the plan file, validated, without interpreting them
+    @classmethod
+    def sections(cls, fspath, fs):
+        try:
+            lines = fs.read_string(fspath).splitlines()
+        except FileNotFoundError:
+            raise PlanError(f"Plan file `{fspath}` not found")
+        sections = []
+        for number, line in enumerate(lines, 1):
+            entry = cls._entry(fspath, number, line)
+            if entry.get("kind") == "header":
+                sections.append([entry])
+            elif not sections or sections[-1][-1]["kind"] == "summary":
+                raise PlanError(f"Plan file `{fspath}` line {number} is outside of a section")
+            else:
+                sections[-1].append(entry)
+        for section in sections:
+            cls._validate(fspath, section)
+        return sections
+
+    @classmethod
+    def _entry(cls, fspath, number, line):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise PlanError(f"Plan file `{fspath}` line {number} is not valid JSON")
+        if entry.get("kind") == "header" and entry.get("version") != cls.VERSION:
+            raise PlanError(f"Plan file `{fspath}` has an unsupported version")
+        return entry
+
+    # A section is complete when it ends with a summary of the number of its operations
+    @staticmethod
+    def _validate(fspath, section):
+        count = sum(1 for entry in section if entry["kind"] == "operation")
+        if section[-1]["kind"] != "summary" or section[-1]["count"] != count:
+            raise PlanError(f"Plan file `{fspath}` is incomplete")
+
+    @classmethod
+    def load(cls, fspath, fs, generator=None, bundler=None, validator=None, resolver=None):
+        generator = generator or DockerPlantUMLGenerator()
+        resolver = resolver or PlantUMLIncludeResolver()
+        bundler = bundler or OpenAPIBundler()
+        validator = validator or OpenAPIValidator()
+        plans = []
+        for header, *entries in cls.sections(fspath, fs):
+            plan = Plan(
+                header["repo"],
+                header["from"],
+                header["to"],
+                [],
+                sync_state=SyncState(**header["sync_state"]) if header["sync_state"] else None,
+                dependencies=(
+                    DependencyGraph(header["from"], header["dependencies"])
+                    if header["dependencies"] is not None
+                    else None
+                ),
+            )
+            for entry in entries:
+                if entry["kind"] == "operation":
+                    plan.operations.append(
+                        operation_from_plan(entry, generator, bundler, validator, resolver)
+                    )
+                    plan.listing.append(entry["listing"])
+                    if "source" in entry:
+                        plan.sources[entry["source"]] = (
+                            entry["source_size"],
+                            entry["source_mtime_ns"],
+                            entry["source_sha256"],
+                        )
+                elif entry["kind"] == "index":
+                    (plan.index_added if entry["change"] == "add" else plan.index_removed).append(
+                        entry["file"]
+                    )
+            plans.append(plan)
+        return plans
+
+    # Combines the plan files of several repositories into one
+    @classmethod
+    def merge(cls, fspaths, fspath, fs):
+        sections = [section for path in fspaths for section in cls.sections(path, fs)]
+        repos = set()
+        for header, *_ in sections:
+            if (header["to"], header["repo"]) in repos:
+                raise PlanError(f"More than one plan for repository `{header['repo']}`")
+            repos.add((header["to"], header["repo"]))
+        fs.write_string(
+            fspath, "".join(serialize(entry) for section in sections for entry in section)
+        )
+
+
+def serialize(entry):
+    return json.dumps(entry, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+# Returns the size, mtime and sha256 of a file, or Nones if it doesn't exist
+def file_details(fs, file):
+    if not fs.is_file(file):
+        return None, None, None
+    stat = fs.stat(file)
+    return stat.size, stat.mtime_ns, fs.digest(file)
+
+
+def operation_from_plan(entry, generator, bundler, validator, resolver=None):
+    if entry["type"] == "copy":
+        return GenericFileCopyOperation(entry["source"], entry["destination"])
+    if entry["type"] == "markdown":
+        return YAMLPrefaceEnrichingCopyOperation(
+            entry["source"], entry["destination"], entry["from"], entry["author"], entry["branch"]
+        )
+    if entry["type"] == "delete":
+        return DeleteOperation(entry["destination"])
+    if entry["type"] == "plantuml":
+        return PlantUMLDiagramRenderOperation(
+            entry["source"], entry["destination"], generator, resolver
+        )
+    if entry["type"] == "openapi":
+        return OpenAPIOperation(
+            entry["source"], entry["destination"], entry["ref_files"], bundler, validator
+        )
+    raise PlanError(f"Unknown operation type `{entry['type']}` in plan")
@@ -0,0 +1,34 @@
+from unittest.mock import Mock
+
+from cache import DirectoryCache, S3Cache, cache_from
+from filesystem import MockFilesystem
+
+
+def test_directory_cache():
+    fs = MockFilesystem({})
+    cache = DirectoryCache("/tmp/cache", fs)
+
+    assert cache.get("abcdef") is None
+    cache.put("abcdef", "<svg/>")
+    assert cache.get("abcdef") == "<svg/>"
+    assert fs.is_file("/tmp/cache/ab/abcdef")
+
+
+def test_s3_cache():
+    runner = Mock(return_value=Mock(returncode=0, stdout=b"<svg/>"))
+    cache = S3Cache("s3://bucket/renders/", runner)
+
+    assert cache.get("abcdef") == "<svg/>"
+    assert runner.call_args[0][0] == ["aws", "s3", "cp", "s3://bucket/renders/ab/abcdef", "-"]
+
+    cache.put("abcdef", "<svg/>")
+    assert runner.call_args[0][0] == ["aws", "s3", "cp", "-", "s3://bucket/renders/ab/abcdef"]
+    assert runner.call_args[1]["input"] == b"<svg/>"
+
+    runner.return_value = Mock(returncode=1)
+    assert cache.get("abcdef") is None
+
+
+def test_cache_from():
+    assert isinstance(cache_from("s3://bucket/renders", MockFilesystem({})), S3Cache)
+    assert isinstance(cache_from("/tmp/cache", MockFilesystem({})), DirectoryCache)
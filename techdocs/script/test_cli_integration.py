@@ -1,6 +1,7 @@
 import json
 import os
 import subprocess
+import sys
 
 import pytest
 from filesystem import Filesystem
@@ -46,7 +47,7 @@ def test_integration(tmp_path):
     assert (
         subprocess.run(
             [
-                "python",
+                sys.executable,
                 "cli.py",
                 "copy",
                 "--from",
@@ -57,10 +58,145 @@ def test_integration(tmp_path):
                 os.path.join(tmp_path, "config.json"),
                 "--index",
                 "promil",
-            ]
+            ],
+            # No git (or anything else) is needed unless the sync is incremental
+            env={"PATH": ""},
         ).returncode
         == 0
     )
     assert os.path.exists(os.path.join(tmp_path, "dst/docs/promil/bla.md"))
     assert os.path.exists(os.path.join(tmp_path, "dst/docs/promil/somedir/one.md"))
     assert not os.path.exists(os.path.join(tmp_path, "dst/docs/promil/somedir/two.txt"))
+
+
+def git(repo, *args):
+    subprocess.run(
+        ["git", "-C", repo, "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_incremental_integration(tmp_path):
+    src, dst = os.path.join(tmp_path, "src"), os.path.join(tmp_path, "dst")
+    prepare_fs(
+        {
+            os.path.join(tmp_path, k): v
+            for k, v in {
+                "src/docs/one.md": "one",
+                "src/docs/two.md": "two",
+                "src/docs/three.md": "three",
+                "dst/projects.json": json.dumps({"promil": {"path": "docs/promil"}}),
+                "config.json": json.dumps(
+                    {
+                        "documents": [
+                            {"project": "promil", "source": "docs/*", "destination": "somedir/"}
+                        ],
+                    }
+                ),
+            }.items()
+        }
+    )
+    git(src, "init")
+    git(src, "add", ".")
+    git(src, "commit", "-m", "initial")
+
+    def sync():
+        return subprocess.run(
+            [
+                "python",
+                "cli.py",
+                "copy",
+                "--from",
+                src,
+                "--to",
+                dst,
+                "--config",
+                os.path.join(tmp_path, "config.json"),
+                "--index",
+                "promil",
+                "--incremental",
+            ],
+            capture_output=True,
+        )
+
+    assert "no record of a previous sync" in sync().stderr.decode()
+    # Changes not committed to git are not seen by incremental syncs
+    os.remove(os.path.join(dst, "docs/promil/somedir/three.md"))
+    prepare_fs({os.path.join(src, "docs/one.md"): "one, changed"})
+    os.remove(os.path.join(src, "docs/two.md"))
+    git(src, "commit", "-a", "-m", "change")
+
+    result = sync()
+
+    assert result.returncode == 0
+    assert "1 changed, 1 deleted files" in result.stderr.decode()
+    assert result.stdout.decode().splitlines() == [
+        "* [COPY] docs/one.md -> docs/promil/somedir/one.md",
+        "* [DELETE] docs/promil/somedir/two.md",
+    ]
+    with open(os.path.join(dst, "docs/promil/somedir/one.md")) as f:
+        assert f.read().endswith("one, changed")
+    assert not os.path.exists(os.path.join(dst, "docs/promil/somedir/three.md"))
+
+
+def test_plan_and_apply_integration(tmp_path):
+    src, dst = os.path.join(tmp_path, "src"), os.path.join(tmp_path, "dst")
+    plan_path = os.path.join(tmp_path, "plan.jsonl")
+    prepare_fs(
+        {
+            os.path.join(tmp_path, k): v
+            for k, v in {
+                "src/docs/one.md": "one",
+                "src/docs/two.txt": "two",
+                "dst/projects.json": json.dumps({"promil": {"path": "docs/promil"}}),
+                "config.json": json.dumps(
+                    {
+                        "documents": [
+                            {"project": "promil", "source": "docs/*", "destination": "somedir/"}
+                        ],
+                    }
+                ),
+            }.items()
+        }
+    )
+
+    planned = subprocess.run(
+        [
+            "python",
+            "cli.py",
+            "plan",
+            "--from",
+            src,
+            "--to",
+            dst,
+            "--config",
+            os.path.join(tmp_path, "config.json"),
+            "--index",
+            "promil",
+            "--plan",
+            plan_path,
+        ],
+        capture_output=True,
+    )
+
+    assert planned.returncode == 0
+    assert len(planned.stdout.decode().splitlines()) == 2
+    assert not os.path.exists(os.path.join(dst, "docs/promil/somedir/one.md"))
+    assert not os.path.exists(os.path.join(dst, ".index"))
+
+    shown = subprocess.run(["python", "cli.py", "show", "--plan", plan_path], capture_output=True)
+    counted = subprocess.run(
+        ["python", "cli.py", "show", "--count", "--plan", plan_path], capture_output=True
+    )
+
+    assert shown.stdout == planned.stdout
+    assert counted.stdout.decode() == "2\n"
+
+    applied = subprocess.run(["python", "cli.py", "apply", "--plan", plan_path])
+
+    assert applied.returncode == 0
+    assert os.path.exists(os.path.join(dst, "docs/promil/somedir/one.md"))
+    assert os.path.exists(os.path.join(dst, "docs/promil/somedir/two.txt"))
+    with open(os.path.join(dst, ".index/promil.jsonl")) as f:
+        assert len(f.read().splitlines()) == 2
@@ -0,0 +1,81 @@
+import io
+from unittest.mock import Mock
+
+import pytest
+
+from comparison import HASH, MISSING, MTIME, PARTIAL_HASH, SIZE, TieredComparator
+from filesystem import MockFilesystem
+from hash import HashCache
+
+
+@pytest.mark.parametrize(
+    "testcase, source, destination, trust_mtime, partial_hash, expected, expected_tier",
+    [
+        ("missing", "abc", None, False, False, True, MISSING),
+        ("size", "abc", "abcd", False, False, True, SIZE),
+        ("same", "abc", "abc", False, False, False, HASH),
+        ("same_mtime", "abc", "abd", True, False, False, MTIME),
+        ("same_size", "abc", "abd", False, False, True, HASH),
+        ("partial_hash", "a" * 70000, "b" * 70000, False, True, True, PARTIAL_HASH),
+        ("same_beginning", "a" * 70000, "a" * 69999 + "b", False, True, True, HASH),
+    ],
+)
+def test_tiered_comparator(
+    testcase, source, destination, trust_mtime, partial_hash, expected, expected_tier
+):
+    files = {"/tmp/Promil/a-file": source}
+    if destination is not None:
+        files["/tmp/dst/a-file"] = destination
+    comparator = TieredComparator(trust_mtime, partial_hash)
+
+    changed = comparator.has_changes(MockFilesystem(files), "/tmp/Promil/a-file", "/tmp/dst/a-file")
+
+    assert changed == expected
+    assert dict(comparator.tally) == {expected_tier: 1}
+
+
+def test_tiered_comparator_does_not_read_files_of_different_size():
+    fs = MockFilesystem({"/tmp/Promil/a-file": "abc", "/tmp/dst/a-file": "abcd"})
+    fs.read_bytes = Mock(wraps=fs.read_bytes)
+
+    assert TieredComparator().has_changes(fs, "/tmp/Promil/a-file", "/tmp/dst/a-file")
+    assert fs.read_bytes.call_count == 0
+
+
+def test_tiered_comparator_trusts_mtime_preserved_by_copy():
+    fs = MockFilesystem({"/tmp/Promil/a-file": "abc"})
+    fs.copy("/tmp/Promil/a-file", "/tmp/dst/a-file")
+    fs.read_bytes = Mock(wraps=fs.read_bytes)
+
+    assert not TieredComparator(trust_mtime=True).has_changes(
+        fs, "/tmp/Promil/a-file", "/tmp/dst/a-file"
+    )
+    assert fs.read_bytes.call_count == 0
+
+
+def test_tiered_comparator_report():
+    comparator = TieredComparator()
+    fs = MockFilesystem({"/tmp/Promil/a-file": "abc", "/tmp/dst/a-file": "abcd"})
+    comparator.has_changes(fs, "/tmp/Promil/a-file", "/tmp/dst/a-file")
+    comparator.has_changes(fs, "/tmp/Promil/a-file", "/tmp/dst/b-file")
+    out = io.StringIO()
+
+    comparator.report(out)
+
+    assert out.getvalue() == (
+        "Compared 2 files, resolved by: missing=1, size=1, mtime=0, partial-hash=0, hash=0\n"
+    )
+
+
+def test_tiered_comparator_caches_partial_hashes():
+    fs = MockFilesystem(
+        {"/tmp/Promil/a-file": "a" * 70000, "/tmp/dst/a-file": "b" * 70000},
+        hash_cache=HashCache(),
+    )
+    comparator = TieredComparator(partial_hash=True)
+    comparator.has_changes(fs, "/tmp/Promil/a-file", "/tmp/dst/a-file")
+    fs.read_bytes = Mock(wraps=fs.read_bytes)
+
+    assert comparator.has_changes(fs, "/tmp/Promil/a-file", "/tmp/dst/a-file")
+    assert fs.read_bytes.call_count == 0
+    assert dict(comparator.tally) == {PARTIAL_HASH: 2}
@@ -1,8 +1,9 @@
 import json
+from unittest.mock import Mock
 
 import pytest
 
-from config import ConfigError, ConfigLoader
+from config import ConfigError, ConfigLoader, ProjectDetailsReader
 from filesystem import MockFilesystem
 
 
@@ -171,3 +172,25 @@ def test_skip_invalid_documents():
         "/tmp/techdocs/config.json", skip_invalid_documents=True
     )
     assert len(config.documents) == 1
+
+
+def test_project_details_reader_parses_projects_once():
+    fs = MockFilesystem({"/tmp/bar/projects.json": json.dumps({"promil": {"path": "docs/promil"}})})
+    fs.read_string = Mock(wraps=fs.read_string)
+    fs.stat = Mock(wraps=fs.stat)
+    reader = ProjectDetailsReader("/tmp/bar", fs)
+
+    assert reader.doc_path("promil") == "docs/promil"
+    assert reader.doc_path("promil") == "docs/promil"
+    assert fs.read_string.call_count == 1
+    assert fs.stat.call_count == 2
+
+
+def test_project_details_reader_reloads_changed_projects():
+    fs = MockFilesystem({"/tmp/bar/projects.json": json.dumps({"promil": {"path": "docs/promil"}})})
+    reader = ProjectDetailsReader("/tmp/bar", fs)
+    assert reader.doc_path("promil") == "docs/promil"
+
+    fs.write_string("/tmp/bar/projects.json", json.dumps({"promil": {"path": "docs/promil-moved"}}))
+
+    assert reader.doc_path("promil") == "docs/promil-moved"
@@ -1,10 +1,25 @@
 import json
+import threading
+from unittest.mock import Mock
 
 import pytest
 from config import ConfigLoader
-from copier import Copier
+from copier import (
+    Copier,
+    Executor,
+    ParallelExecutor,
+    RenderError,
+    RenderPool,
+    independent_batches,
+)
 from detectors import CopyDetector, OperationDetectorChain
 from filesystem import MockFilesystem
+from operations import (
+    DeleteOperation,
+    GenericFileCopyOperation,
+    OpenAPIOperation,
+    PlantUMLDiagramRenderOperation,
+)
 
 
 @pytest.fixture
@@ -94,3 +109,123 @@ def test_copier(filesystem):
     assert filesystem.is_file("/tmp/bar/docs/promil/somedir/recursive/one/due.txt")
     assert filesystem.is_file("/tmp/bar/docs/promil/somedir/recursive/one/two/due.txt")
     assert not filesystem.is_file("/tmp/bar/docs/promil/somedir/recursive/one/two/due.doc")
+
+
+def test_parallel_executor(capsys):
+    fs = MockFilesystem(
+        {
+            **{f"/tmp/foo/file-{i}": f"content-{i}" for i in range(10)},
+            "/tmp/bar/old-file": "blabla",
+        }
+    )
+    operations = [
+        GenericFileCopyOperation(f"/tmp/foo/file-{i}", f"/tmp/bar/dir-{i % 3}/file-{i}")
+        for i in range(10)
+    ] + [DeleteOperation("/tmp/bar/old-file")]
+
+    Copier(operations, fs, ParallelExecutor(fs, jobs=4)).execute()
+
+    for i in range(10):
+        assert fs.read_string(f"/tmp/bar/dir-{i % 3}/file-{i}") == f"content-{i}"
+    assert not fs.is_file("/tmp/bar/old-file")
+    assert capsys.readouterr().out.splitlines() == [
+        f"* [COPY] /tmp/foo/file-{i} -> /tmp/bar/dir-{i % 3}/file-{i}" for i in range(10)
+    ] + ["* [DELETE] /tmp/bar/old-file"]
+
+
+def test_independent_batches():
+    first = GenericFileCopyOperation("/tmp/foo/a", "/tmp/bar/a")
+    second = GenericFileCopyOperation("/tmp/foo/b", "/tmp/bar/b")
+    delete = DeleteOperation("/tmp/bar/c")
+    third = GenericFileCopyOperation("/tmp/foo/c", "/tmp/bar/c")
+    overwriting = GenericFileCopyOperation("/tmp/foo/other/c", "/tmp/bar/c")
+
+    assert list(independent_batches([first, second, delete, third, overwriting])) == [
+        [first, second],
+        [delete],
+        [third],
+        [overwriting],
+    ]
+
+
+def test_executor_prefetches_diagrams():
+    fs = MockFilesystem({"/tmp/foo/a.puml": "a", "/tmp/foo/b.puml": "b", "/tmp/foo/c.md": "c"})
+    generator = Mock(generate=Mock(return_value="<svg >diagram</svg>"))
+
+    Executor(fs).execute_all(
+        [
+            PlantUMLDiagramRenderOperation("/tmp/foo/a.puml", "/tmp/bar/a.svg", generator),
+            GenericFileCopyOperation("/tmp/foo/c.md", "/tmp/bar/c.md"),
+            PlantUMLDiagramRenderOperation("/tmp/foo/b.puml", "/tmp/bar/b.svg", generator),
+        ]
+    )
+
+    generator.prefetch.assert_called_once_with(fs, ["/tmp/foo/a.puml", "/tmp/foo/b.puml"])
+    assert generator.generate.call_count == 2
+
+
+def test_executor_prefetches_specs():
+    fs = MockFilesystem({"/tmp/foo/a.yaml": "a", "/tmp/foo/b.yaml": "b"})
+    bundler = Mock(bundle=Mock(return_value="{}"))
+    validator = Mock()
+    specs = [
+        ("/tmp/foo/a.yaml", ["/tmp/foo/b.yaml"], "/tmp/bar/a.json"),
+        ("/tmp/foo/b.yaml", [], "/tmp/bar/b.json"),
+    ]
+
+    Executor(fs).execute_all(
+        [
+            OpenAPIOperation(source, destination, ref_files, bundler, validator)
+            for source, ref_files, destination in specs
+        ]
+    )
+
+    validator.prefetch.assert_called_once_with(fs, specs)
+    bundler.prefetch.assert_called_once_with(fs, specs)
+
+
+def test_render_pool(capsys):
+    fs = MockFilesystem({f"/tmp/foo/{name}.puml": name for name in ["a", "b", "broken"]})
+    # Both renders have to be running at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def generate(fs, source):
+        if "broken" in source:
+            raise Exception("syntax error")
+        barrier.wait()
+        return "<svg >diagram</svg>"
+
+    generator = Mock(generate=Mock(side_effect=generate))
+    operations = [
+        PlantUMLDiagramRenderOperation(f"/tmp/foo/{name}.puml", f"/tmp/bar/{name}.svg", generator)
+        for name in ["broken", "a", "b"]
+    ]
+
+    with pytest.raises(RenderError, match="1 of 3 renders failed:\n/tmp/foo/broken.puml: syntax"):
+        RenderPool(fs, 3).execute_all(operations)
+
+    assert fs.is_file("/tmp/bar/a.svg") and fs.is_file("/tmp/bar/b.svg")
+    output = capsys.readouterr()
+    assert len(output.out.splitlines()) == 3
+    assert "Rendered /tmp/foo/a.puml in" in output.err
+    assert "Render of /tmp/foo/broken.puml failed after" in output.err
+
+
+def test_executor_does_not_delete_after_failed_render(capsys):
+    fs = MockFilesystem({"/tmp/foo/a.md": "a", "/tmp/foo/a.puml": "a", "/tmp/bar/old.md": "old"})
+    generator = Mock(generate=Mock(side_effect=Exception("syntax error")))
+    operations = [
+        GenericFileCopyOperation("/tmp/foo/a.md", "/tmp/bar/a.md"),
+        PlantUMLDiagramRenderOperation("/tmp/foo/a.puml", "/tmp/bar/a.svg", generator),
+        DeleteOperation("/tmp/bar/old.md"),
+    ]
+
+    with pytest.raises(RenderError):
+        Executor(fs).execute_all(operations)
+
+    assert fs.is_file("/tmp/bar/a.md")
+    assert fs.is_file("/tmp/bar/old.md")
+    assert capsys.readouterr().out.splitlines() == [
+        "* [COPY] /tmp/foo/a.md -> /tmp/bar/a.md",
+        "* [PLANTUML] /tmp/foo/a.puml -> /tmp/bar/a.svg",
+    ]
@@ -0,0 +1,32 @@
+from dependencies import DependencyGraph, DependencyGraphLoader
+from filesystem import MockFilesystem
+
+
+def test_dependency_graph():
+    graph = DependencyGraph("/tmp/Promil")
+    graph.record("/tmp/Promil/docs/a.puml", ["/tmp/Promil/styles/common.puml"])
+    graph.record(
+        "/tmp/Promil/api/spec.yaml",
+        ["/tmp/Promil/api/components.yaml", "/tmp/Promil/styles/common.puml"],
+    )
+    graph.record("/tmp/Promil/docs/b.puml", [])
+
+    assert graph.dependents({"styles/common.puml"}) == {"docs/a.puml", "api/spec.yaml"}
+    assert graph.dependents({"api/components.yaml", "docs/b.puml"}) == {"api/spec.yaml"}
+
+    graph.record("/tmp/Promil/docs/a.puml", [])
+    graph.forget(["api/spec.yaml"])
+    assert graph.dependents({"styles/common.puml"}) == set()
+
+
+def test_dependency_graph_save_and_load():
+    fs = MockFilesystem({})
+    graph = DependencyGraph("/tmp/Promil")
+    graph.record("/tmp/Promil/docs/a.puml", ["/tmp/Promil/b.puml", "/tmp/Promil/a.puml"])
+
+    DependencyGraphLoader.save(graph, "/tmp/dst/.index", "Promil", fs)
+
+    assert DependencyGraphLoader.load("/tmp/dst/.index", "Promil", fs, "/tmp/Promil").edges == {
+        "docs/a.puml": {"a.puml", "b.puml"}
+    }
+    assert DependencyGraphLoader.load("/tmp/dst/.index", "Other", fs, "/tmp/Promil") is None
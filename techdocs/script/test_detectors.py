@@ -6,12 +6,16 @@ from config import Config, ConfigDocumentEntry
 from detectors import (
     CopyDetector,
     DeleteDetector,
+    OperationDetectorChain,
     PlantUMLDiagramsDetector,
     UnnecessaryOperationsFilteringDetector,
+    index_diff,
     swap_extension,
 )
+from dependencies import DependencyGraph
 from filesystem import MockFilesystem
-from index import FileIndex, FileIndexItem, FileIndexLoader
+from hash import hashb
+from index import FileIndex, FileIndexError, FileIndexItem, FileIndexLoader
 from operations import GenericFileCopyOperation, DeleteOperation
 from detectors import OpenAPIDetector
 
@@ -48,6 +52,98 @@ def test_copy():
     assert operations[2].destination_abs == "/tmp/dst/docs/promil/inner/maintenance.md"
 
 
+def test_copy_evaluates_each_file_once():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/docs/README.md": "readme",
+            "/tmp/Promil/docs/inner/setup.md": "setup",
+            "/tmp/Promil/other/file.txt": "other",
+            "/tmp/dst/projects.json": json.dumps({"promil": {"path": "docs/promil"}}),
+        }
+    )
+    detector = CopyDetector(
+        "/tmp/Promil",
+        "/tmp/dst",
+        "Γιώργος Σεφέρης",
+        "master",
+        Config([ConfigDocumentEntry("promil", "docs/*", ".", [])]),
+    )
+    detector._create_operation = Mock(wraps=detector._create_operation)
+
+    operations = detector.detect(fs, [])
+
+    assert len(operations) == 2
+    assert detector._create_operation.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "file,expected_rule",
+    (
+        ("docs/one.md", 0),
+        ("docs/internal/int.md", 1),  # excluded by the first rule, falls through to the second
+        ("docs/first.txt", 2),  # excluded by the first rule, not matched by the second
+        ("other/uno.txt", None),
+        ("README.md", None),
+    ),
+)
+def test_rule_set_reports_first_matching_rule(file, expected_rule):
+    detector = CopyDetector(
+        "/tmp/foo",
+        "/tmp/bar",
+        "Γιώργος Σεφέρης",
+        "master",
+        Config(
+            [
+                ConfigDocumentEntry(
+                    "promil", "docs/*", "somedir/", ["docs/internal/*", "docs/*.txt"]
+                ),
+                ConfigDocumentEntry("promil", "docs/internal/*", "internal/", []),
+                ConfigDocumentEntry("promil", "docs/*.txt", "texts/", []),
+            ]
+        ),
+    )
+
+    rule = detector.rule_set.match(file)
+
+    if expected_rule is None:
+        assert rule is None
+    else:
+        assert rule is detector.copy_rules[expected_rule]
+
+
+@pytest.mark.parametrize(
+    "directory,expected",
+    (
+        ("docs/", True),
+        ("docs/inner/", True),
+        ("docs/internal/", False),  # excluded as a whole
+        ("other/", True),
+        ("other/level/", True),  # may not contain matches, but the prefix alone can't tell
+        ("recursive/", True),
+        ("recursive/one/two/", True),
+        ("node_modules/", False),
+        ("doc/", False),
+    ),
+)
+def test_rule_set_prunes_directories(directory, expected):
+    detector = CopyDetector(
+        "/tmp/foo",
+        "/tmp/bar",
+        "Γιώργος Σεφέρης",
+        "master",
+        Config(
+            [
+                ConfigDocumentEntry("promil", "README.md", "bla.md", []),
+                ConfigDocumentEntry("promil", "docs/*", "somedir/", ["docs/internal/*"]),
+                ConfigDocumentEntry("promil", "other/*.txt", "somedir/", []),
+                ConfigDocumentEntry("promil", "recursive/**/*.txt", "somedir/", []),
+            ]
+        ),
+    )
+
+    assert detector.rule_set.may_contain(directory) == expected
+
+
 @pytest.mark.parametrize(
     "file,rule_source,rule_destination,expected_source,expected_destination",
     (
@@ -98,6 +194,33 @@ def test_copy_create_operation_variants(
     assert copy_operation.destination_abs == expected_destination
 
 
+def test_copy_limited_to_paths():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/docs/README.md": "readme",
+            "/tmp/Promil/docs/inner/setup.md": "setup",
+            "/tmp/dst/projects.json": json.dumps({"promil": {"path": "docs/promil"}}),
+        }
+    )
+    detector = CopyDetector(
+        "/tmp/Promil",
+        "/tmp/dst",
+        "Γιώργος Σεφέρης",
+        "master",
+        Config([ConfigDocumentEntry("promil", "docs/*", ".", [])]),
+        paths={"docs/inner/setup.md", "docs/deleted.md", "other/file.md"},
+    )
+
+    operations = detector.detect(fs, [])
+
+    assert [op.source_abs for op in operations] == ["/tmp/Promil/docs/inner/setup.md"]
+    assert detector.destinations(fs, {"docs/deleted.md", "docs/a.puml", "other/file.md"}) == {
+        "docs/promil/deleted.md",
+        "docs/promil/a.puml",
+        "docs/promil/a.svg",
+    }
+
+
 def test_index_load():
     fs = MockFilesystem(
         {
@@ -120,33 +243,133 @@ def test_index_load():
 def test_index_save():
     fs = MockFilesystem({})
 
+    index = FileIndex(())
+    index.add(FileIndexItem("heheszek", "Promil-platform-foo"))
+    index.add(FileIndexItem("foo/bar", "Promil-platform-foo"))
+    index.add(FileIndexItem("baz/huehue", "Promil-platform-bar"))
+    FileIndexLoader.save(index, "/foo/index", fs)
+
+    assert list(sorted(fs.scan("/foo/index", ".*"))) == [
+        "Promil-platform-bar.jsonl",
+        "Promil-platform-foo.jsonl",
+    ]
+    assert fs.read_string("/foo/index/Promil-platform-foo.jsonl") == (
+        '{"file": "foo/bar", "repo": "Promil-platform-foo"}\n'
+        '{"file": "heheszek", "repo": "Promil-platform-foo"}\n'
+    )
+    assert FileIndexLoader.load("/foo/index", fs).items_for("Promil-platform-foo") == (
+        FileIndexItem("foo/bar", "Promil-platform-foo"),
+        FileIndexItem("heheszek", "Promil-platform-foo"),
+    )
+
+
+def test_index_save_migrates_legacy_layout():
+    fs = MockFilesystem(
+        {
+            f"/foo/index/{item.repo}/{hashb(item.file.encode())}": json.dumps(
+                {"file": item.file, "repo": item.repo}
+            )
+            for item in (
+                FileIndexItem("heheszek", "PiwikPRO/Promil"),
+                FileIndexItem("foo/bar", "PiwikPRO/Promil"),
+                FileIndexItem("baz/huehue", "PiwikPRO/Promil-platform-bar"),
+            )
+        }
+    )
+
+    FileIndexLoader.save(FileIndexLoader.load("/foo/index", fs), "/foo/index", fs)
+
+    assert sorted(fs.scan("/foo/index", ".*")) == [
+        "PiwikPRO%2FPromil-platform-bar.jsonl",
+        "PiwikPRO%2FPromil.jsonl",
+    ]
+    assert FileIndexLoader.load("/foo/index", fs).items_for("PiwikPRO/Promil") == (
+        FileIndexItem("foo/bar", "PiwikPRO/Promil"),
+        FileIndexItem("heheszek", "PiwikPRO/Promil"),
+    )
+
+
+def test_index_of_owner_and_repository_roundtrip():
+    fs = MockFilesystem(
+        {
+            "/foo/index/PiwikPRO%2FPromil.sync.json": '{"revision": "abc", "fingerprint": "def"}',
+            "/foo/index/PiwikPRO%2FPromil.deps.json": '{"one.puml": ["common.puml"]}',
+        }
+    )
+    index = FileIndexLoader.load("/foo/index", fs)
+    index.add(FileIndexItem("heheszek", "PiwikPRO/Promil"))
+    FileIndexLoader.save(index, "/foo/index", fs)
+
+    index = FileIndexLoader.load("/foo/index", fs)
+    index.add(FileIndexItem("foo/bar", "PiwikPRO/Promil"))
+    FileIndexLoader.save(index, "/foo/index", fs)
+
+    assert FileIndexLoader.load("/foo/index", fs).items == (
+        FileIndexItem("foo/bar", "PiwikPRO/Promil"),
+        FileIndexItem("heheszek", "PiwikPRO/Promil"),
+    )
+    assert fs.is_file("/foo/index/PiwikPRO%2FPromil.sync.json")
+
+
+def test_index_save_writes_only_changed_repositories(capsys):
+    fs = MockFilesystem(
+        {
+            "/foo/index/Promil-platform-foo.jsonl": (
+                '{"file": "heheszek", "repo": "Promil-platform-foo"}\n'
+            ),
+            "/foo/index/Promil-platform-bar.jsonl": (
+                '{"file": "baz/huehue", "repo": "Promil-platform-bar"}\n'
+            ),
+            "/foo/index/Promil-platform-baz.jsonl": (
+                '{"file": "qux", "repo": "Promil-platform-baz"}\n'
+            ),
+        }
+    )
+    index = FileIndexLoader.load("/foo/index", fs)
+    index.add(FileIndexItem("foo/bar", "Promil-platform-foo"))
+    index.remove(FileIndexItem("baz/huehue", "Promil-platform-bar"))
+    fs.write_string = Mock(wraps=fs.write_string)
+
+    FileIndexLoader.save(index, "/foo/index", fs)
+
+    assert [c[0][0] for c in fs.write_string.call_args_list] == [
+        "/foo/index/Promil-platform-foo.jsonl"
+    ]
+    assert not fs.is_file("/foo/index/Promil-platform-bar.jsonl")
+    assert fs.is_file("/foo/index/Promil-platform-baz.jsonl")
+    assert capsys.readouterr().err == (
+        "Index: 1 added, 1 removed, 2 repository files updated, "
+        "1 unchanged entries not rewritten\n"
+    )
+
+
+def test_index_add_and_remove():
     index = FileIndex(
         (
             FileIndexItem("heheszek", "Promil-platform-foo"),
-            FileIndexItem("foo/bar", "Promil-platform-foo"),
             FileIndexItem("baz/huehue", "Promil-platform-bar"),
         )
     )
-    FileIndexLoader.save(index, "/foo/index", fs)
 
-    assert list(sorted(fs.scan("/foo/index", ".*"))) == list(
-        sorted(
-            [
-                "Promil-platform-foo/42af564a885e1f38be3f411de2584efc3462bba68e9b5ea6dc39364b061d0a8f",
-                "Promil-platform-foo/cc5d46bdb4991c6eae3eb739c9c8a7a46fe9654fab79c47b4fe48383b5b25e1c",
-                "Promil-platform-bar/4db8a688c5803846883870d0e15d84c33fb492ad5d8b67a9b7199d3eeeaa1907",
-            ]
-        )
+    index.add(FileIndexItem("foo/bar", "Promil-platform-foo"))
+    index.add(FileIndexItem("heheszek", "Promil-platform-foo"))
+    index.remove(FileIndexItem("baz/huehue", "Promil-platform-bar"))
+    index.remove(FileIndexItem("not-indexed", "Promil-platform-bar"))
+
+    assert index.items == (
+        FileIndexItem("heheszek", "Promil-platform-foo"),
+        FileIndexItem("foo/bar", "Promil-platform-foo"),
     )
+    assert index.items_for("Promil-platform-foo") == index.items
+    assert index.items_for("Promil-platform-bar") == ()
+    assert index.removed == (FileIndexItem("baz/huehue", "Promil-platform-bar"),)
 
-    assert json.loads(
-        fs.read_string(
-            "/foo/index/Promil-platform-foo/42af564a885e1f38be3f411de2584efc3462bba68e9b5ea6dc39364b061d0a8f"
-        )
-    ) == {
-        "file": "heheszek",
-        "repo": "Promil-platform-foo",
-    }
+
+def test_index_add_conflicting_repo():
+    index = FileIndex((FileIndexItem("heheszek", "Promil-platform-foo"),))
+
+    with pytest.raises(FileIndexError):
+        index.add(FileIndexItem("heheszek", "Promil-platform-bar"))
 
 
 def test_delete():
@@ -187,9 +410,70 @@ def test_delete():
 
     assert operations[1].destination_abs == "/tmp/dst/a-file-that-does-not-exist-anymore"
     assert index.items == (FileIndexItem("a-file", "Promil"),)
+    assert index.added == ()
     assert index.removed == (FileIndexItem("a-file-that-does-not-exist-anymore", "Promil"),)
 
 
+def test_delete_limited_to_scope():
+    index = FileIndex(
+        (
+            FileIndexItem("a-file", "Promil"),
+            FileIndexItem("not-scanned", "Promil"),
+            FileIndexItem("deleted", "Promil"),
+        )
+    )
+    detector = DeleteDetector("Promil", index, "/tmp/Promil", "/tmp/dst", scope={"deleted"})
+
+    operations = detector.detect(
+        MockFilesystem({}),
+        [GenericFileCopyOperation("/tmp/Promil/a-file", "/tmp/dst/a-file")],
+    )
+
+    assert [op.name() for op in operations] == ["copy", "delete"]
+    assert operations[1].destination_abs == "/tmp/dst/deleted"
+    assert index.items == (
+        FileIndexItem("a-file", "Promil"),
+        FileIndexItem("not-scanned", "Promil"),
+    )
+
+
+def test_delete_does_not_alter_previous_operations():
+    previous_operations = (GenericFileCopyOperation("/tmp/Promil/a-file", "/tmp/dst/a-file"),)
+    detector = DeleteDetector(
+        "Promil",
+        FileIndex((FileIndexItem("gone", "Promil"),)),
+        "/tmp/Promil",
+        "/tmp/dst",
+    )
+
+    operations = detector.detect(MockFilesystem({}), previous_operations)
+
+    assert len(operations) == 2
+    assert len(previous_operations) == 1
+
+
+def test_chain_shares_operations_between_detectors():
+    operation = GenericFileCopyOperation("/tmp/Promil/a-file", "/tmp/dst/a-file")
+    first = Mock(detect=Mock(return_value=[operation]))
+    second = Mock(detect=Mock(side_effect=lambda fs, previous: list(previous)))
+
+    operations = OperationDetectorChain(first, second).operations(MockFilesystem({}))
+
+    assert operations == [operation]
+    assert operations[0] is operation
+    assert second.detect.call_args[0][1] == (operation,)
+
+
+def test_index_diff():
+    deleted, added = index_diff(
+        (FileIndexItem("kept", "Promil"), FileIndexItem("gone", "Promil")),
+        {"kept": None, "new": None},
+    )
+
+    assert deleted == [FileIndexItem("gone", "Promil")]
+    assert added == ["new"]
+
+
 def test_filtering():
     fs = MockFilesystem(
         {
@@ -218,6 +502,31 @@ def test_filtering():
     assert operations[0].destination_abs == "/tmp/dst/a-file-that-does-not-exist-anymore"
 
 
+def test_filtering_in_parallel_keeps_order():
+    fs = MockFilesystem(
+        {
+            **{f"/tmp/Promil/file-{i}": f"content-{i}" for i in range(20)},
+            **{f"/tmp/dst/file-{i}": f"content-{i}" for i in range(0, 20, 2)},
+        }
+    )
+    detector = UnnecessaryOperationsFilteringDetector(jobs=4)
+
+    operations = detector.detect(
+        fs,
+        [
+            GenericFileCopyOperation(
+                source_abs=f"/tmp/Promil/file-{i}",
+                destination_abs=f"/tmp/dst/file-{i}",
+            )
+            for i in range(20)
+        ],
+    )
+
+    assert [op.source_abs for op in operations] == [
+        f"/tmp/Promil/file-{i}" for i in range(1, 20, 2)
+    ]
+
+
 def test_plantuml():
     # given
     fs = MockFilesystem(
@@ -352,6 +661,7 @@ def test_openapi_detector_json():
         {
             "itsa me": "openapi",
             "x-api-checksum": "5891d4bf2471e070e3675a5eedc88fe724e572bc2053e7b2bf00fb3862cd4c8a",
+            "x-api-ref-checksums": {},
         },
         indent=2,
     )
@@ -359,6 +669,12 @@ def test_openapi_detector_json():
         {
             "itsa me": "openapi",
             "x-api-checksum": "ab740669e63a90c75c3192818aa5c6a820ce71a8f53aa84354dad77183e27730",
+            "x-api-ref-checksums": {
+                "../components.json": hashb(fs.read_bytes("/tmp/Promil/components.json")),
+                "../nested-components.json": hashb(
+                    fs.read_bytes("/tmp/Promil/nested-components.json")
+                ),
+            },
         },
         indent=2,
     )
@@ -366,6 +682,12 @@ def test_openapi_detector_json():
         {
             "itsa me": "openapi",
             "x-api-checksum": "ab740669e63a90c75c3192818aa5c6a820ce71a8f53aa84354dad77183e27730",
+            "x-api-ref-checksums": {
+                "../components.json": hashb(fs.read_bytes("/tmp/Promil/components.json")),
+                "../nested-components.json": hashb(
+                    fs.read_bytes("/tmp/Promil/nested-components.json")
+                ),
+            },
         },
         indent=2,
     )
@@ -450,6 +772,7 @@ paths:
         {
             "itsa me": "openapi",
             "x-api-checksum": "f356dad852f2b8108be36a19c8e148c8b3ed5811c9bd072f2603d46c4aa4a0e6",
+            "x-api-ref-checksums": {},
         },
         indent=2,
     )
@@ -457,6 +780,7 @@ paths:
         {
             "itsa me": "openapi",
             "x-api-checksum": "d1ff36ee679797e54a3c6e7858e70cfabcb642641fa14f614b173d439f9d3642",
+            "x-api-ref-checksums": {"../components.yaml": hashb(b"openapi: 3.1.0")},
         },
         indent=2,
     )
@@ -464,6 +788,61 @@ paths:
         {
             "itsa me": "openapi",
             "x-api-checksum": "9d02b4bf2b95c5617f7cb10ef16cc881793b2cf08486b04163aa948f10002822",
+            "x-api-ref-checksums": {},
         },
         indent=2,
     )
+
+
+def test_detectors_record_dependencies():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/a.puml": "!include styles/common.puml",
+            "/tmp/Promil/styles/common.puml": "!include colors.puml",
+            "/tmp/Promil/styles/colors.puml": "",
+            "/tmp/Promil/spec.json": '{"openapi": "3.1.0","paths": {"$ref": "components.json#/a"}}',
+            "/tmp/Promil/components.json": '{"a": "b"}',
+        }
+    )
+    dependencies = DependencyGraph("/tmp/Promil")
+    operations = [
+        GenericFileCopyOperation("/tmp/Promil/a.puml", "/tmp/dst/a.puml"),
+        GenericFileCopyOperation("/tmp/Promil/spec.json", "/tmp/dst/spec.json"),
+        GenericFileCopyOperation("/tmp/Promil/components.json", "/tmp/dst/components.json"),
+    ]
+
+    operations = PlantUMLDiagramsDetector(Mock(), dependencies=dependencies).detect(fs, operations)
+    OpenAPIDetector(Mock(), Mock(), dependencies).detect(fs, operations)
+
+    assert dependencies.edges == {
+        "a.puml": {"styles/common.puml", "styles/colors.puml"},
+        "spec.json": {"components.json"},
+    }
+
+
+def test_openapi_detector_reads_files_once():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/fixture.json": json.dumps({"data": ["x" * 100] * 1000}),
+            "/tmp/Promil/spec.json": '{"openapi": "3.1.0","paths": {"$ref": "components.json#/a"}}',
+            "/tmp/Promil/other.json": '{"openapi": "3.1.0","paths": {"$ref": "components.json"}}',
+            "/tmp/Promil/components.json": '{"a": "b"}',
+        }
+    )
+    read_string = Mock(wraps=fs.read_string)
+    fs.read_string = read_string
+
+    operations = OpenAPIDetector(Mock(), Mock()).detect(
+        fs,
+        [
+            GenericFileCopyOperation(f"/tmp/Promil/{name}", f"/tmp/dst/{name}")
+            for name in ["fixture.json", "spec.json", "other.json", "components.json"]
+        ],
+    )
+
+    assert [operation.name() for operation in operations] == ["copy", "copy", "openapi", "openapi"]
+    assert sorted(call.args[0] for call in read_string.call_args_list) == [
+        "/tmp/Promil/components.json",
+        "/tmp/Promil/other.json",
+        "/tmp/Promil/spec.json",
+    ]
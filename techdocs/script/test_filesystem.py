@@ -0,0 +1,72 @@
+import os
+import types
+
+from filesystem import FileStat, Filesystem, MockFilesystem
+
+
+def prepare_fs(root, files):
+    fs = Filesystem()
+    for file, content in files.items():
+        fs.write_string(os.path.join(root, file), content)
+    return fs
+
+
+def test_scan_skips_directories_that_can_not_match(tmp_path):
+    fs = prepare_fs(
+        tmp_path,
+        {
+            "docs/one.md": "blabla",
+            "docs/internal/int.md": "blabla",
+            "node_modules/pkg/README.md": "blabla",
+        },
+    )
+    visited = []
+
+    def descend(directory):
+        visited.append(directory)
+        return directory.startswith("docs/") and directory != "docs/internal/"
+
+    files = fs.scan(str(tmp_path), ".*", descend)
+
+    assert files == ["docs/one.md"]
+    assert "node_modules/pkg/" not in visited
+
+
+def test_walk_yields_entries_with_stat_lazily(tmp_path):
+    fs = prepare_fs(tmp_path, {"a.md": "a", "docs/b.md": "bb", "docs/inner/c.md": "ccc"})
+
+    entries = fs.walk(str(tmp_path))
+
+    assert isinstance(entries, types.GeneratorType)
+    by_path = {entry.path: entry.stat for entry in entries}
+    assert sorted(by_path) == ["a.md", "docs/b.md", "docs/inner/c.md"]
+    stat = os.stat(os.path.join(tmp_path, "docs/inner/c.md"))
+    assert by_path["docs/inner/c.md"] == FileStat(3, stat.st_mtime_ns, stat.st_ino)
+
+
+def test_walk_stats_files_on_first_access(tmp_path):
+    fs = prepare_fs(tmp_path, {"a.md": "a"})
+
+    entry = next(fs.walk(str(tmp_path)))
+    fs.write_string(os.path.join(tmp_path, "a.md"), "aaa")
+
+    assert entry.stat.size == 3
+    fs.write_string(os.path.join(tmp_path, "a.md"), "aaaaa")
+    assert entry.stat.size == 3
+
+
+def test_walk_matches_scan_of_mock_filesystem():
+    fs = MockFilesystem({"/tmp/foo/a.md": "a", "/tmp/foo/docs/b.md": "bb", "/tmp/bar/c.md": "c"})
+
+    assert [entry.path for entry in fs.walk("/tmp/foo")] == fs.scan("/tmp/foo", ".*")
+    assert [entry.stat.size for entry in fs.walk("/tmp/foo")] == [1, 2]
+
+
+def test_read_tail(tmp_path):
+    fs = Filesystem()
+    fs.write_string(os.path.join(tmp_path, "file"), "0123456789")
+    mock = MockFilesystem({"/tmp/file": "0123456789"})
+
+    for filesystem, file in ((fs, os.path.join(tmp_path, "file")), (mock, "/tmp/file")):
+        assert filesystem.read_tail(file, 3) == b"789"
+        assert filesystem.read_tail(file, 100) == b"0123456789"
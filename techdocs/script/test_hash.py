@@ -0,0 +1,68 @@
+import json
+from unittest.mock import Mock
+
+from filesystem import MockFilesystem
+from hash import HashCache, HashCacheLoader, hashb
+from operations import GenericFileCopyOperation
+
+
+def test_hash_cache_does_not_read_unchanged_files():
+    fs = MockFilesystem(
+        {"/tmp/Promil/a-file": "a-file-content", "/tmp/dst/a-file": "a-file-content"},
+        hash_cache=HashCache(),
+    )
+    fs.read_bytes = Mock(wraps=fs.read_bytes)
+    operation = GenericFileCopyOperation("/tmp/Promil/a-file", "/tmp/dst/a-file")
+
+    assert not operation.has_changes(fs)
+    assert not operation.has_changes(fs)
+    assert fs.read_bytes.call_count == 2
+
+
+def test_hash_cache_rehashes_modified_files():
+    fs = MockFilesystem({"/tmp/Promil/a-file": "a-file-content"}, hash_cache=HashCache())
+    assert fs.digest("/tmp/Promil/a-file") == hashb(b"a-file-content")
+
+    fs.write_string("/tmp/Promil/a-file", "other-content")
+
+    assert fs.digest("/tmp/Promil/a-file") == hashb(b"other-content")
+
+
+def test_hash_cache_keeps_derived_values_apart():
+    fs = MockFilesystem({"/tmp/dst/spec.json": '{"x-api-checksum": "abc"}'}, hash_cache=HashCache())
+
+    checksum = fs.digest(
+        "/tmp/dst/spec.json", "checksum", lambda b: json.loads(b)["x-api-checksum"]
+    )
+
+    assert checksum == "abc"
+    assert fs.digest("/tmp/dst/spec.json") == hashb(b'{"x-api-checksum": "abc"}')
+
+
+def test_hash_cache_save_and_load():
+    fs = MockFilesystem({"/tmp/Promil/a-file": "a-file-content", "/tmp/Promil/b-file": "b"})
+    cache = HashCache()
+    cache.digest(fs, "/tmp/Promil/a-file", "sha256", hashb)
+    cache.digest(fs, "/tmp/Promil/b-file", "sha256", hashb)
+    fs.delete("/tmp/Promil/b-file")
+
+    HashCacheLoader.save(cache, "/tmp/cache/hashcache.json", fs)
+    loaded = HashCacheLoader.load("/tmp/cache/hashcache.json", fs)
+
+    assert list(loaded.entries) == ["sha256:/tmp/Promil/a-file"]
+    fs.read_bytes = Mock(wraps=fs.read_bytes)
+    assert loaded.digest(fs, "/tmp/Promil/a-file", "sha256", hashb) == hashb(b"a-file-content")
+    assert fs.read_bytes.call_count == 0
+
+
+def test_hash_cache_load_ignores_missing_file():
+    assert HashCacheLoader.load("/tmp/cache/hashcache.json", MockFilesystem({})).entries == {}
+
+
+def test_hash_cache_without_file_is_kept_in_memory():
+    fs = MockFilesystem({"/tmp/Promil/a-file": "a-file-content"})
+
+    with HashCacheLoader.loaded(None, fs) as cache:
+        cache.digest(fs, "/tmp/Promil/a-file", "sha256", hashb)
+
+    assert list(fs.files) == ["/tmp/Promil/a-file"]
@@ -0,0 +1,106 @@
+from unittest.mock import Mock
+
+from dependencies import DependencyGraph
+from filesystem import MockFilesystem
+from incremental import (
+    Git,
+    GitChanges,
+    SyncState,
+    SyncStateLoader,
+    fingerprint,
+    incremental_changes,
+)
+
+
+def git_returning(returncode, stdout=b""):
+    return Git(runner=Mock(return_value=Mock(returncode=returncode, stdout=stdout)))
+
+
+def test_git_changes_since():
+    git = git_returning(
+        0,
+        b"M\0docs/one.md\0A\0docs/new.md\0D\0docs/gone.md\0R087\0docs/old.md\0docs/moved.md\0",
+    )
+
+    changes = git.changes_since("/tmp/Promil", "abc123")
+
+    assert changes == GitChanges(
+        {"docs/one.md", "docs/new.md", "docs/moved.md"}, {"docs/gone.md", "docs/old.md"}
+    )
+    assert git.runner.call_args[0][0][-2:] == ["abc123", "HEAD"]
+
+
+def test_git_changes_since_unknown_revision():
+    assert git_returning(128).changes_since("/tmp/Promil", "abc123") is None
+
+
+def test_incremental_changes_uses_stored_revision():
+    git = git_returning(0, b"M\0docs/one.md\0")
+
+    changes = incremental_changes(git, "/tmp/Promil", SyncState("abc123", "fp"), "fp")
+
+    assert changes == GitChanges({"docs/one.md"}, set())
+    assert git.runner.call_args[0][0][-2:] == ["abc123", "HEAD"]
+
+
+def test_incremental_changes_prefers_explicit_revision():
+    git = git_returning(0, b"M\0docs/one.md\0")
+
+    incremental_changes(git, "/tmp/Promil", SyncState("abc123", "fp"), "fp", since="def456")
+
+    assert git.runner.call_args[0][0][-2:] == ["def456", "HEAD"]
+
+
+def test_incremental_changes_with_explicit_revision_checks_fingerprint(capsys):
+    git = git_returning(0, b"M\0docs/one.md\0")
+
+    state = SyncState("abc123", "old")
+    assert incremental_changes(git, "/tmp/Promil", state, "fp", since="def456") is None
+    assert "config or projects.json changed" in capsys.readouterr().err
+    assert incremental_changes(git, "/tmp/Promil", None, "fp", since="def456") is not None
+
+
+def test_incremental_changes_falls_back_to_full_scan(capsys):
+    git = git_returning(0, b"M\0docs/one.md\0")
+
+    assert incremental_changes(git, "/tmp/Promil", None, "fp") is None
+    assert incremental_changes(git, "/tmp/Promil", SyncState("abc123", "old"), "fp") is None
+    assert incremental_changes(git_returning(128), "/tmp/Promil", None, "fp", "abc") is None
+    assert (
+        incremental_changes(
+            git_returning(0, b"M\0docs/diagram.puml\0"), "/tmp/Promil", None, "fp", "abc"
+        )
+        is None
+    )
+    assert capsys.readouterr().err.count("scanning all files") == 4
+
+
+def test_incremental_changes_adds_dependents(capsys):
+    git = git_returning(0, b"M\0styles/common.puml\0D\0api/components.yaml\0")
+    dependencies = DependencyGraph(
+        "/tmp/Promil",
+        {
+            "docs/a.puml": ["styles/common.puml"],
+            "docs/b.puml": [],
+            "api/spec.yaml": ["api/components.yaml"],
+        },
+    )
+
+    changes = incremental_changes(
+        git, "/tmp/Promil", SyncState("abc123", "fp"), "fp", dependencies=dependencies
+    )
+
+    assert changes == GitChanges(
+        {"styles/common.puml", "docs/a.puml", "api/spec.yaml"}, {"api/components.yaml"}
+    )
+    assert "1 changed, 1 deleted files, 2 dependent files" in capsys.readouterr().err
+
+
+def test_sync_state_save_and_load():
+    fs = MockFilesystem({"/tmp/config.json": "{}", "/tmp/dst/projects.json": "{}"})
+    state = SyncState("abc123", fingerprint(fs, "/tmp/config.json", "/tmp/dst/projects.json"))
+
+    SyncStateLoader.save(state, "/tmp/dst/.index", "Promil", fs)
+
+    assert SyncStateLoader.load("/tmp/dst/.index", "Promil", fs) == state
+    assert SyncStateLoader.load("/tmp/dst/.index", "Other", fs) is None
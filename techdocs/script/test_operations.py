@@ -1,11 +1,20 @@
 import json
+import os
+import subprocess
+import sys
 from unittest.mock import Mock
 
 import pytest
 
-from filesystem import MockFilesystem
-from operations import GenericFileCopyOperation, OpenAPIOperation, PlantUMLDiagramRenderOperation, \
-    YAMLPrefaceEnrichingCopyOperation
+from cache import DirectoryCache
+from filesystem import Filesystem, MockFilesystem
+from hash import hashb
+from operations import CachingOpenAPIBundler, CachingOpenAPIValidator, \
+    CachingPlantUMLGenerator, DockerPlantUMLGenerator, \
+    OpenAPIBundler, OpenAPIOperation, OpenAPIValidator, \
+    PlantUMLDiagramRenderOperation, \
+    PlantUMLIncludeError, PlantUMLIncludeResolver, YAMLPrefaceEnrichingCopyOperation, \
+    api_checksums_from_tail, get_full_puml_content
 
 
 def test_yaml_preface_operation(filesystem):
@@ -117,92 +126,428 @@ def test_yaml_preface_has_changes(source, destination, expected):
 
 
 @pytest.mark.parametrize(
-    "testcase, fs_structure, ref_files, previous_operations, expected",
+    "source",
+    (b"#foo\r\nbar\r\n", b"---\r\nfoo: bar\r\n---\r\n#foo\r\n"),
+)
+def test_yaml_preface_has_no_changes_after_copying_crlf_file(tmp_path, source):
+    (tmp_path / "README.md").write_bytes(source)
+    op = YAMLPrefaceEnrichingCopyOperation(
+        str(tmp_path / "README.md"), str(tmp_path / "out/README.md"), str(tmp_path), "John", "main"
+    )
+    fs = Filesystem()
+
+    op.execute(fs)
+
+    assert not op.has_changes(fs)
+
+
+SPEC_CHECKSUM = "efb49e76308ecfad18ff3dcaadad6eade83b07de82e56be4322897038ebb44e2"
+COMPONENTS_CHECKSUM = hashb(b"openapi: 3.1.0")
+
+
+@pytest.mark.parametrize(
+    "testcase, destination, ref_files, expected",
     [
         (
             "no_changes",
             {
-                "/tmp/Promil/subdir/api-with-ref.yaml": """openapi: 3.1.0
-paths:
-    some-path:
-        $ref: ../components.json#/some-component""",
-                "/tmp/dst/subdir/api-with-ref.json": '{"x-api-checksum": "efb49e76308ecfad18ff3dcaadad6eade83b07de82e56be4322897038ebb44e2"}',
+                "x-api-checksum": SPEC_CHECKSUM,
+                "x-api-ref-checksums": {"../components.yaml": COMPONENTS_CHECKSUM},
             },
             ["/tmp/Promil/components.yaml"],
-            [],
             False,
         ),
         (
             "different_checksum",
             {
-                "/tmp/Promil/subdir/api-with-ref.yaml": """openapi: 3.1.0
-paths:
-    some-path:
-        $ref: ../components.json#/some-component""",
-                "/tmp/dst/subdir/api-with-ref.json": '{"x-api-checksum": "checksum-mismatch"}',
+                "x-api-checksum": "checksum-mismatch",
+                "x-api-ref-checksums": {"../components.yaml": COMPONENTS_CHECKSUM},
             },
             ["/tmp/Promil/components.yaml"],
-            [],
             True,
         ),
         (
-            "ref_file_copy_operation",
+            "ref_file_changed",
             {
-                "/tmp/Promil/other-components.yaml": "openapi: 3.1.0",
-                "/tmp/dst/other-components.yaml": "openapi: 3.1.0",
-                "/tmp/Promil/subdir/api-with-ref.yaml": """openapi: 3.1.0
-paths:
-    some-path:
-        $ref: ../components.json#/some-component""",
-                "/tmp/dst/subdir/api-with-ref.json": '{"x-api-checksum": "efb49e76308ecfad18ff3dcaadad6eade83b07de82e56be4322897038ebb44e2"}',
+                "x-api-checksum": SPEC_CHECKSUM,
+                "x-api-ref-checksums": {"../components.yaml": "checksum-mismatch"},
             },
-            ["/tmp/Promil/other-components.yaml", "/tmp/Promil/components.yaml"],
-            [
-                GenericFileCopyOperation(
-                    "/tmp/Promil/other-components.yaml",
-                    "/tmp/dst/other-components.yaml",
-                ),
-                GenericFileCopyOperation(
-                    "/tmp/Promil/components.yaml",
-                    "/tmp/dst/components.yaml",
-                ),
-            ],
+            ["/tmp/Promil/components.yaml"],
             True,
         ),
         (
-            "ref_file_other_operation",
+            "ref_file_added",
             {
-                "/tmp/Promil/subdir/api-with-ref.yaml": """openapi: 3.1.0
-paths:
-    some-path:
-        $ref: ../components.json#/some-component""",
-                "/tmp/dst/subdir/api-with-ref.json": '{"x-api-checksum": "efb49e76308ecfad18ff3dcaadad6eade83b07de82e56be4322897038ebb44e2"}',
+                "x-api-checksum": SPEC_CHECKSUM,
+                "x-api-ref-checksums": {"../components.yaml": COMPONENTS_CHECKSUM},
             },
+            ["/tmp/Promil/components.yaml", "/tmp/Promil/other-components.yaml"],
+            True,
+        ),
+        (
+            "no_ref_checksums",
+            {"x-api-checksum": SPEC_CHECKSUM},
             ["/tmp/Promil/components.yaml"],
-            [
-                PlantUMLDiagramRenderOperation(
-                    "/tmp/Promil/components.yaml", "/tmp/dst/components.yaml", None
-                )
-            ],
+            True,
+        ),
+        (
+            "no_ref_checksums_without_refs",
+            {"x-api-checksum": SPEC_CHECKSUM},
+            [],
             False,
         ),
+        (
+            "no_destination",
+            None,
+            [],
+            True,
+        ),
     ],
 )
-def test_openapi_operation_has_changes(
-    testcase,
-    fs_structure,
-    ref_files,
-    previous_operations,
-    expected,
-):
-    fs = MockFilesystem(fs_structure)
+def test_openapi_operation_has_changes(testcase, destination, ref_files, expected):
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/components.yaml": "openapi: 3.1.0",
+            "/tmp/Promil/other-components.yaml": "openapi: 3.1.0",
+            "/tmp/Promil/subdir/api-with-ref.yaml": """openapi: 3.1.0
+paths:
+    some-path:
+        $ref: ../components.json#/some-component""",
+        }
+    )
+    if destination is not None:
+        fs.write_string("/tmp/dst/subdir/api-with-ref.json", json.dumps(destination))
     operation = OpenAPIOperation(
         "/tmp/Promil/subdir/api-with-ref.yaml",
         "/tmp/dst/subdir/api-with-ref.json",
         ref_files,
         bundler=Mock(bundle=Mock(return_value='{"itsa me":"openapi"}')),
         validator=Mock(return_value=True),
-        previous_operations=previous_operations,
     )
 
     assert operation.has_changes(fs) == expected
+
+
+def test_caching_plantuml_generator():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/a.puml": "@startuml\n!include common.puml\n@enduml",
+            "/tmp/Promil/b.puml": "@startuml\n!include common.puml\n@enduml",
+            "/tmp/Promil/common.puml": "Alice -> Bob",
+        }
+    )
+    renderer = Mock(version="plantuml:1", generate=Mock(return_value="<svg >diagram</svg>"))
+    generator = CachingPlantUMLGenerator(renderer, DirectoryCache("/tmp/cache", fs))
+    operation = PlantUMLDiagramRenderOperation("/tmp/Promil/a.puml", "/tmp/dst/a.svg", generator)
+
+    operation.execute(fs)
+    # Same diagram under a different name, e.g. after a rename
+    PlantUMLDiagramRenderOperation("/tmp/Promil/b.puml", "/tmp/dst/b.svg", generator).execute(fs)
+
+    assert renderer.generate.call_count == 1
+    assert fs.read_string("/tmp/dst/b.svg") == fs.read_string("/tmp/dst/a.svg")
+    assert not operation.has_changes(fs)
+
+    # Included files are part of the key, in the next run
+    fs.write_string("/tmp/Promil/common.puml", "Alice -> Carol")
+    generator = CachingPlantUMLGenerator(renderer, DirectoryCache("/tmp/cache", fs))
+    PlantUMLDiagramRenderOperation("/tmp/Promil/a.puml", "/tmp/dst/a.svg", generator).execute(fs)
+    assert renderer.generate.call_count == 2
+
+    # So is the renderer version
+    renderer.version = "plantuml:2"
+    PlantUMLDiagramRenderOperation("/tmp/Promil/b.puml", "/tmp/dst/b.svg", generator).execute(fs)
+    assert renderer.generate.call_count == 3
+
+
+# Stands in for the PlantUML container: writes <stem>.svg to the mounted /out for every source
+def stub_plantuml_runner(renders):
+    def run(command, **kwargs):
+        if command[1] == "buildx":
+            return Mock(returncode=0, stdout=b"sha256:abc\n")
+        renders.append(command)
+        out = next(arg.split(":")[0] for arg in command if arg.endswith(":/out"))
+        for source in [arg for arg in command if arg.startswith("/src/")]:
+            stem = os.path.splitext(os.path.basename(source))[0]
+            with open(os.path.join(out, stem + ".svg"), "w") as f:
+                f.write(f"<svg>{source}</svg>")
+
+    return run
+
+
+def test_docker_plantuml_generator_prefetch():
+    renders = []
+    generator = DockerPlantUMLGenerator(runner=stub_plantuml_runner(renders))
+    sources = ["/tmp/Promil/a.puml", "/tmp/Promil/docs/b.puml", "/tmp/Promil/docs/a.puml"]
+
+    fs = MockFilesystem({source: "@startuml\n@enduml" for source in sources})
+
+    generator.prefetch(fs, sources)
+
+    # Two runs, as a.svg would be generated twice by the same run otherwise
+    assert len(renders) == 2
+    assert renders[0][renders[0].index("-v") + 1] == "/tmp/Promil:/src"
+    assert generator.generate(None, "/tmp/Promil/a.puml") == "<svg>/src/a.puml</svg>"
+    assert generator.generate(None, "/tmp/Promil/docs/b.puml") == "<svg>/src/docs/b.puml</svg>"
+    assert generator.generate(None, "/tmp/Promil/docs/a.puml") == "<svg>/src/a.puml</svg>"
+    assert len(renders) == 2
+
+    # Diagrams that weren't prefetched are rendered one by one
+    assert generator.generate(None, "/tmp/Promil/a.puml") == "<svg>/src/a.puml</svg>"
+    assert len(renders) == 3
+
+
+def test_docker_plantuml_generator_prefetch_skips_named_diagrams():
+    renders = []
+    generator = DockerPlantUMLGenerator(runner=stub_plantuml_runner(renders))
+    fs = MockFilesystem(
+        {"/tmp/Promil/a.puml": "@startuml b\n@enduml", "/tmp/Promil/b.puml": "@startuml\n@enduml"}
+    )
+
+    generator.prefetch(fs, ["/tmp/Promil/a.puml", "/tmp/Promil/b.puml"])
+
+    assert [arg for arg in renders[0] if arg.startswith("/src/")] == ["/src/b.puml"]
+    assert generator.generate(fs, "/tmp/Promil/b.puml") == "<svg>/src/b.puml</svg>"
+    assert len(renders) == 1
+
+
+def test_caching_plantuml_generator_prefetch():
+    fs = MockFilesystem({"/tmp/Promil/a.puml": "a", "/tmp/Promil/b.puml": "b"})
+    renderer = Mock(version="plantuml:1", generate=Mock(return_value="<svg >diagram</svg>"))
+    generator = CachingPlantUMLGenerator(renderer, DirectoryCache("/tmp/cache", fs))
+    generator.generate(fs, "/tmp/Promil/a.puml")
+
+    generator.prefetch(fs, ["/tmp/Promil/a.puml", "/tmp/Promil/b.puml"])
+
+    renderer.prefetch.assert_called_once_with(fs, ["/tmp/Promil/b.puml"])
+
+
+def test_plantuml_include_resolver():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/a.puml": (
+                "@startuml\n!include styles/common.puml\n!include missing.puml\n@enduml"
+            ),
+            "/tmp/Promil/b.puml": "@startuml\n!include styles/common.puml\n@enduml",
+            "/tmp/Promil/styles/common.puml": "!include ../colors.puml\nskinparam x",
+            "/tmp/Promil/colors.puml": "!define RED #f00",
+        }
+    )
+    resolver = PlantUMLIncludeResolver()
+    read = Mock(wraps=fs.read_bytes)
+    fs.read_bytes = read
+
+    assert resolver.content(fs, "/tmp/Promil/a.puml") == (
+        b"@startuml\n!define RED #f00\nskinparam x\n!include missing.puml\n@enduml"
+    )
+    assert resolver.content(fs, "/tmp/Promil/b.puml") == get_full_puml_content(
+        fs, "/tmp/Promil/b.puml"
+    )
+    read.reset_mock()
+    resolver.content(fs, "/tmp/Promil/a.puml")
+    resolver.content(fs, "/tmp/Promil/b.puml")
+    assert read.call_count == 0
+    assert resolver.dependents("/tmp/Promil/colors.puml") == {
+        "/tmp/Promil/a.puml",
+        "/tmp/Promil/b.puml",
+        "/tmp/Promil/styles/common.puml",
+    }
+    with pytest.raises(FileNotFoundError):
+        resolver.content(fs, "/tmp/Promil/missing.puml")
+
+
+def test_plantuml_include_resolver_cycle():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/a.puml": "!include b.puml",
+            "/tmp/Promil/b.puml": "!include sub/../a.puml",
+        }
+    )
+
+    with pytest.raises(PlantUMLIncludeError, match="b.puml -> /tmp/Promil/a.puml"):
+        PlantUMLIncludeResolver().content(fs, "/tmp/Promil/a.puml")
+
+
+def test_caching_openapi_tools():
+    fs = MockFilesystem(
+        {
+            "/tmp/Promil/api/spec.yaml": "openapi: 3.1.0\npaths:\n  $ref: ../components.yaml",
+            "/tmp/Promil/components.yaml": "a: b",
+        }
+    )
+    bundler = Mock(version="sha256:1", bundle=Mock(return_value='{"itsa me":"openapi"}'))
+    validator = Mock(version="sha256:2")
+    cache = DirectoryCache("/tmp/cache", fs)
+
+    def execute(destination):
+        OpenAPIOperation(
+            "/tmp/Promil/api/spec.yaml",
+            destination,
+            ["/tmp/Promil/components.yaml"],
+            CachingOpenAPIBundler(bundler, cache),
+            CachingOpenAPIValidator(validator, cache),
+        ).execute(fs)
+
+    execute("/tmp/dst/api/spec.json")
+    execute("/tmp/dst/other/spec.json")
+
+    assert bundler.bundle.call_count == 1
+    assert validator.validate.call_count == 1
+    assert fs.read_string("/tmp/dst/other/spec.json") == fs.read_string("/tmp/dst/api/spec.json")
+
+    # A change to a referenced file is a cache miss
+    fs.write_string("/tmp/Promil/components.yaml", "a: c")
+    execute("/tmp/dst/api/spec.json")
+    assert bundler.bundle.call_count == 2
+    assert validator.validate.call_count == 2
+
+
+def test_docker_tools_are_versioned_by_image_digest():
+    runner = Mock(return_value=Mock(returncode=0, stdout=b"sha256:abc\n"))
+
+    assert DockerPlantUMLGenerator(runner).version == "sha256:abc"
+    assert OpenAPIBundler(runner).version == "sha256:abc"
+    assert OpenAPIValidator(runner).version == "sha256:abc"
+    assert OpenAPIBundler(runner).image == f"{OpenAPIBundler.IMAGE}@sha256:abc"
+    runner.assert_any_call(
+        [
+            "docker",
+            "buildx",
+            "imagetools",
+            "inspect",
+            "--format",
+            "{{.Manifest.Digest}}",
+            DockerPlantUMLGenerator.IMAGE,
+        ],
+        capture_output=True,
+    )
+    # The digest is only looked up once per image, and the images are not pulled
+    assert runner.call_count == 3
+
+
+def test_docker_tools_fall_back_to_the_local_image_digest():
+    def run(command, **kwargs):
+        if command[1] == "buildx":
+            return Mock(returncode=1, stdout=b"")
+        return Mock(returncode=0, stdout=f"{OpenAPIValidator.IMAGE}@sha256:def\n".encode())
+
+    runner = Mock(side_effect=run)
+
+    assert OpenAPIValidator(runner).version == "sha256:def"
+    assert ["docker", "pull", OpenAPIValidator.IMAGE] not in [c.args[0] for c in runner.mock_calls]
+
+    unknown = OpenAPIValidator(Mock(return_value=Mock(returncode=1, stdout=b"")))
+    assert unknown.image == OpenAPIValidator.IMAGE
+    with pytest.raises(Exception, match="Could not determine the digest"):
+        unknown.version
+
+
+STUB_OPENAPI_TOOL = """
+import sys
+if sys.argv[1] == "bundle":
+    with open(sys.argv[sys.argv.index("--output") + 1], "w") as f:
+        f.write('{"bundled": "' + sys.argv[3] + '"}')
+elif "invalid" in sys.argv[2]:
+    sys.exit("invalid spec")
+"""
+
+
+# Stands in for docker: runs the OpenAPI tools' commands (the batch scripts too) locally, with a
+# stub tool as the image's entrypoint and the volumes' paths substituted
+def stub_docker(tmp_path, runs):
+    tool = tmp_path / "tool.py"
+    tool.write_text(STUB_OPENAPI_TOOL)
+
+    def run(command, **kwargs):
+        if command[1] == "buildx":
+            return Mock(returncode=0, stdout=b"sha256:abc\n")
+        if command[:3] == ["docker", "image", "inspect"]:
+            return Mock(returncode=0, stdout=json.dumps([sys.executable, str(tool)]).encode())
+        runs.append(command)
+        mounts, i = {}, 2
+        while command[i].startswith("-"):
+            if command[i] == "-v":
+                host, container = command[i + 1].rsplit(":", 1)
+                mounts[container] = host
+            i += 2
+        arguments = command[i + 1 :]
+        if "--entrypoint" not in command:
+            arguments = [sys.executable, str(tool), *arguments]
+        for container, host in mounts.items():
+            arguments = [argument.replace(container, host) for argument in arguments]
+        if "--entrypoint" in command:
+            arguments = ["sh", *arguments]
+        return subprocess.run(arguments, cwd=mounts["/spec"], capture_output=True)
+
+    return run
+
+
+def test_openapi_tools_prefetch(tmp_path):
+    for name in ["api/one.yaml", "api/other/two.yaml", "api/invalid.yaml", "components.yaml"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("openapi: 3.1.0")
+    specs = [
+        (str(tmp_path / "api/one.yaml"), [str(tmp_path / "components.yaml")], "/dst/one.json"),
+        (str(tmp_path / "api/other/two.yaml"), [], "/dst/two.json"),
+        (str(tmp_path / "api/invalid.yaml"), [], "/dst/invalid.json"),
+    ]
+    runs = []
+    validator = OpenAPIValidator(runner=stub_docker(tmp_path, runs))
+    bundler = OpenAPIBundler(runner=stub_docker(tmp_path, runs))
+
+    validator.prefetch(None, specs)
+    bundler.prefetch(None, specs)
+
+    assert len(runs) == 2
+    assert runs[0][runs[0].index("-v") + 1] == f"{tmp_path}:/spec"
+    validator.validate(None, *specs[0][:2])
+    validator.validate(None, *specs[1][:2])
+    assert json.loads(bundler.bundle(None, *specs[1])) == {"bundled": specs[1][0]}
+    assert len(runs) == 2
+    # Failures are reported by validating the spec on its own
+    with pytest.raises(Exception, match="invalid spec"):
+        validator.validate(None, *specs[2][:2])
+    assert len(runs) == 3
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        (
+            json.dumps(
+                {"a": 1, "x-api-checksum": "abc", "x-api-ref-checksums": {"b.yaml": "def"}},
+                indent=2,
+            ),
+            {"x-api-checksum": "abc", "x-api-ref-checksums": {"b.yaml": "def"}},
+        ),
+        ('{"x-api-checksum": "abc"}', {"x-api-checksum": "abc"}),
+        # Not at the end, or not there at all
+        (
+            '{"x-api-checksum": "abc", "nested": {"a": 1}, "b": 2}',
+            {"x-api-checksum": "abc", "nested": {"a": 1}, "b": 2},
+        ),
+        ('{"nested": {"x-api-checksum": "abc"}, "b": 2}', None),
+        ('{"a": 1}', None),
+    ],
+)
+def test_api_checksums_from_tail(content, expected):
+    assert api_checksums_from_tail(content.encode()) == expected
+
+
+def test_openapi_operation_has_changes_reads_the_end_of_the_destination():
+    fs = MockFilesystem(
+        {"/tmp/Promil/api.yaml": "openapi: 3.1.0", "/tmp/Promil/components.yaml": "a: b"}
+    )
+    operation = OpenAPIOperation(
+        "/tmp/Promil/api.yaml",
+        "/tmp/dst/api.json",
+        ["/tmp/Promil/components.yaml"],
+        bundler=Mock(bundle=Mock(return_value=json.dumps({"paths": "x" * 1024 * 1024}))),
+        validator=Mock(),
+    )
+    operation.execute(fs)
+    read_bytes = Mock(wraps=fs.read_bytes)
+    fs.read_bytes = read_bytes
+
+    assert not operation.has_changes(fs)
+    assert "/tmp/dst/api.json" not in [call.args[0] for call in read_bytes.call_args_list]
@@ -0,0 +1,151 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from dependencies import DependencyGraph
+from filesystem import MockFilesystem
+from hash import hashb
+from incremental import SyncState
+from operations import (
+    DeleteOperation,
+    GenericFileCopyOperation,
+    OpenAPIOperation,
+    PlantUMLDiagramRenderOperation,
+    YAMLPrefaceEnrichingCopyOperation,
+)
+from plan import Plan, PlanError, PlanLoader, serialize
+
+
+def example_plan(repo="foo"):
+    return Plan(
+        repo,
+        f"/tmp/{repo}",
+        "/tmp/bar",
+        [
+            GenericFileCopyOperation(f"/tmp/{repo}/one.txt", "/tmp/bar/one.txt"),
+            YAMLPrefaceEnrichingCopyOperation(
+                f"/tmp/{repo}/one.md", "/tmp/bar/one.md", f"/tmp/{repo}", "John", "main"
+            ),
+            DeleteOperation("/tmp/bar/old.md"),
+            PlantUMLDiagramRenderOperation(f"/tmp/{repo}/one.puml", "/tmp/bar/one.svg", None),
+            OpenAPIOperation(
+                f"/tmp/{repo}/api.yaml",
+                "/tmp/bar/api.json",
+                {f"/tmp/{repo}/b.yaml", f"/tmp/{repo}/a.yaml"},
+                None,
+                None,
+            ),
+        ],
+        ["one.md"],
+        ["old.md"],
+        SyncState("abc123", "fingerprint"),
+        DependencyGraph(f"/tmp/{repo}", {"one.puml": ["common.puml"]}),
+    )
+
+
+def test_plan_roundtrip():
+    fs = MockFilesystem(
+        {"/tmp/foo/one.txt": "one", "/tmp/bar/one.txt": "uno", "/tmp/bar/old.md": "old"}
+    )
+    saved = example_plan()
+    PlanLoader.save([saved], "/tmp/plan.jsonl", fs)
+
+    (plan,) = PlanLoader.load("/tmp/plan.jsonl", fs)
+
+    assert plan.count == 5
+    assert [operation.to_plan() for operation in plan.operations] == [
+        operation.to_plan() for operation in saved.operations
+    ]
+    assert plan.operations[4].to_plan()["ref_files"] == ["/tmp/foo/a.yaml", "/tmp/foo/b.yaml"]
+    assert (plan.repo, plan.from_path, plan.to_path) == ("foo", "/tmp/foo", "/tmp/bar")
+    assert (plan.index_added, plan.index_removed) == (["one.md"], ["old.md"])
+    assert plan.sync_state == SyncState("abc123", "fingerprint")
+    assert plan.dependencies.edges == {"one.puml": {"common.puml"}}
+    assert plan.sources["/tmp/foo/one.txt"] == (3, 0, hashb(b"one"))
+    assert plan.sources["/tmp/foo/one.md"] == (None, None, None)
+    assert plan.listing[2:4] == ["* [DELETE] old.md", "* [PLANTUML] one.puml -> one.svg"]
+
+
+def test_plan_serialization():
+    fs = MockFilesystem({"/tmp/foo/one.txt": "one", "/tmp/bar/one.txt": "uno"})
+    PlanLoader.save([example_plan()], "/tmp/plan.jsonl", fs)
+
+    lines = fs.read_string("/tmp/plan.jsonl").splitlines()
+
+    assert [json.loads(line)["kind"] for line in lines] == [
+        "header",
+        *["operation"] * 5,
+        "index",
+        "index",
+        "summary",
+    ]
+    assert json.loads(lines[1]) == {
+        "kind": "operation",
+        "type": "copy",
+        "source": "/tmp/foo/one.txt",
+        "source_size": 3,
+        "source_mtime_ns": 0,
+        "source_sha256": hashb(b"one"),
+        "destination": "/tmp/bar/one.txt",
+        "destination_size": 3,
+        "destination_mtime_ns": 0,
+        "destination_sha256": hashb(b"uno"),
+        "listing": "* [COPY] one.txt -> one.txt",
+    }
+    # Stable serialization, so that plans can be diffed
+    assert all(line + "\n" == serialize(json.loads(line)) for line in lines)
+
+
+def test_plan_stale_files():
+    fs = MockFilesystem({"/tmp/foo/one.txt": "one", "/tmp/foo/one.md": "one"})
+    PlanLoader.save([example_plan()], "/tmp/plan.jsonl", fs)
+    fs.write_string("/tmp/foo/one.txt", "two")
+    fs.delete("/tmp/foo/one.md")
+
+    (plan,) = PlanLoader.load("/tmp/plan.jsonl", fs)
+
+    assert plan.stale_files(fs) == ["/tmp/foo/one.txt", "/tmp/foo/one.md"]
+
+
+def test_plan_stale_files_does_not_read_files_with_same_size_and_mtime():
+    fs = MockFilesystem({"/tmp/foo/one.txt": "one", "/tmp/foo/one.md": "one"})
+    PlanLoader.save([example_plan()], "/tmp/plan.jsonl", fs)
+    (plan,) = PlanLoader.load("/tmp/plan.jsonl", fs)
+    fs.read_bytes = Mock(wraps=fs.read_bytes)
+
+    assert plan.stale_files(fs) == []
+    assert fs.read_bytes.call_count == 0
+
+
+def test_plan_merge():
+    fs = MockFilesystem({})
+    PlanLoader.save([example_plan("foo")], "/tmp/foo.jsonl", fs)
+    PlanLoader.save([example_plan("baz")], "/tmp/baz.jsonl", fs)
+
+    PlanLoader.merge(["/tmp/foo.jsonl", "/tmp/baz.jsonl"], "/tmp/plan.jsonl", fs)
+
+    assert [plan.repo for plan in PlanLoader.load("/tmp/plan.jsonl", fs)] == ["foo", "baz"]
+    with pytest.raises(PlanError):
+        PlanLoader.merge(["/tmp/foo.jsonl", "/tmp/plan.jsonl"], "/tmp/other.jsonl", fs)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        None,
+        "not json",
+        '{"kind": "header", "version": 0}',
+        '{"kind": "operation", "type": "delete", "destination": "/tmp/bar/old.md"}',
+        '{"kind": "header", "version": 4, "repo": "foo", "from": "/tmp/foo", "to": "/tmp/bar", '
+        '"sync_state": null}',
+        '{"kind": "header", "version": 4, "repo": "foo", "from": "/tmp/foo", "to": "/tmp/bar", '
+        '"sync_state": null, "dependencies": null}\n{"kind": "operation", "type": "unknown"}\n'
+        '{"kind": "summary", "count": 1}',
+    ],
+)
+def test_plan_load_errors(content):
+    fs = MockFilesystem({} if content is None else {"/tmp/plan.jsonl": content})
+
+    with pytest.raises(PlanError):
+        PlanLoader.load("/tmp/plan.jsonl", fs)